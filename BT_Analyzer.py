@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+@author: smerino
+"""
+
+import ast
+import hashlib
+
+# Action nodes available to the LLM and the order of their positional arguments
+ACTION_ARGUMENTS = {
+    "MoveToDestination": ["name", "destination", "mqtt"],
+    "SpeakMessage": ["name", "message", "mqtt"],
+    "Reminder": ["name", "mqtt"],
+    "AskQuestion": ["name", "question", "mqtt"],
+    "Condition": ["name", "variable", "value", "mqtt", "timeout"],
+    "Videoconference": ["name", "contact", "mqtt"],
+    "Alert": ["name", "message", "contact", "mqtt"],
+    "DetectFall": ["name", "mqtt"]
+}
+
+# Positional arguments of the py_trees composites and decorators
+COMPOSITE_ARGUMENTS = ["name", "memory", "children"]
+PARALLEL_ARGUMENTS = ["name", "policy", "children"]
+DECORATOR_ARGUMENTS = ["name", "child"]
+
+
+# -------------------------------------------------------
+# BTFacts
+# -------------------------------------------------------
+# Structural facts of a generated create_behavior_tree():
+# - nodes: variable -> {"class", "name"} in declaration order.
+#   Nodes built inline get the variable Class@line:column
+# - edges: (parent variable, child variable) pairs from
+#   add_children/add_child calls, children= and child=
+# - root: variable returned by the function
+# - condition_variables, destinations, contacts: literal
+#   arguments of the Condition, MoveToDestination,
+#   Videoconference and Alert nodes
+# Arguments that are not literals are stored as None.
+class BTFacts():
+    def __init__(self):
+        self.nodes = {}
+        self.edges = []
+        self.root = None
+        self.condition_variables = []
+        self.destinations = []
+        self.contacts = []
+
+    # Names of the action nodes, in declaration order
+    def action_names(self):
+        return [node["name"] for node in self.nodes.values() if node["class"] in ACTION_ARGUMENTS]
+
+    # Variables of the children of a node, in order
+    def children(self, variable):
+        return [child for parent, child in self.edges if parent == variable]
+
+    def to_dict(self):
+        return {
+            "nodes": self.nodes,
+            "edges": [list(edge) for edge in self.edges],
+            "root": self.root,
+            "condition_variables": self.condition_variables,
+            "destinations": self.destinations,
+            "contacts": self.contacts
+        }
+
+
+# Returns the create_behavior_tree() definition of a parsed module
+def find_create_behavior_tree(module):
+    for node in ast.walk(module):
+        if isinstance(node, ast.FunctionDef) and node.name == "create_behavior_tree":
+            return node
+    return None
+
+
+# Statements of create_behavior_tree(), without the try/except
+# block that usually wraps them
+def function_body(function):
+    body = []
+    for statement in function.body:
+        if isinstance(statement, ast.Try):
+            body.extend(statement.body)
+        else:
+            body.append(statement)
+    return body
+
+
+# Dotted name of a called function ("py_trees.composites.Sequence")
+def call_name(call):
+    parts = []
+    func = call.func
+    while isinstance(func, ast.Attribute):
+        parts.append(func.attr)
+        func = func.value
+    if isinstance(func, ast.Name):
+        parts.append(func.id)
+    return ".".join(reversed(parts))
+
+
+# Value of a literal argument, None otherwise
+def literal(node):
+    if isinstance(node, ast.Constant):
+        return node.value
+    return None
+
+
+# Short class and positional arguments of a node constructor,
+# (None, None) if the call does not build a node
+def node_class(call):
+    cls = call_name(call)
+    short_cls = cls.split(".")[-1]
+    if short_cls in ACTION_ARGUMENTS:
+        return short_cls, ACTION_ARGUMENTS[short_cls]
+    if short_cls == "Parallel":
+        return short_cls, PARALLEL_ARGUMENTS
+    if ".composites." in f".{cls}":
+        return short_cls, COMPOSITE_ARGUMENTS
+    if ".decorators." in f".{cls}":
+        return short_cls, DECORATOR_ARGUMENTS
+    return None, None
+
+
+# Variable given to a node that is not assigned to one
+def inline_variable(call, short_cls):
+    return f"{short_cls}@{call.lineno}:{call.col_offset}"
+
+
+# Maps the positional and keyword arguments of a call to their names
+def call_arguments(call, positional):
+    arguments = dict(zip(positional, call.args))
+    for keyword in call.keywords:
+        if keyword.arg:
+            arguments[keyword.arg] = keyword.value
+    return arguments
+
+
+# -------------------------------------------------------
+# remove_try_except
+# -------------------------------------------------------
+# Some BTs wrap create_behavior_tree() in try/except blocks.
+# For analysis, we strip them away so that we can execute
+# the function directly without swallowing errors. Code
+# that cannot be parsed is returned unchanged.
+def remove_try_except(bt_code):
+    try:
+        module = ast.parse(bt_code)
+    except SyntaxError:
+        return bt_code
+    function = find_create_behavior_tree(module)
+    if function is None or not any(isinstance(s, ast.Try) for s in function.body):
+        return bt_code
+    function.body = function_body(function)
+    return ast.unparse(module) + "\n"
+
+
+# -------------------------------------------------------
+# bt_hash
+# -------------------------------------------------------
+# Normalized hash of a BT source: the hash of its AST dump,
+# so formatting and comments do not change it. Code that
+# cannot be parsed is hashed with its whitespace collapsed.
+def bt_hash(bt_code):
+    try:
+        normalized = ast.dump(ast.parse(bt_code))
+    except SyntaxError:
+        normalized = " ".join(bt_code.split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+# -------------------------------------------------------
+# analyse_bt
+# -------------------------------------------------------
+# Reads the LLM output once, without executing it, and
+# returns its BTFacts. Every call in create_behavior_tree()
+# is visited, so nodes built inline (as an argument of
+# add_children or child=) or inside if/for blocks are
+# found too. Raises SyntaxError if the code cannot be
+# parsed.
+def analyse_bt(bt_code):
+    facts = BTFacts()
+    function = find_create_behavior_tree(ast.parse(bt_code))
+    if function is None:
+        return facts
+
+    # Node declarations: variable = Class(...)
+    assigned = {}
+    for statement in ast.walk(function):
+        if isinstance(statement, ast.Assign) and isinstance(statement.value, ast.Call):
+            targets = [t.id for t in statement.targets if isinstance(t, ast.Name)]
+            if targets:
+                assigned[statement.value] = targets[0]
+
+    # Node constructors in source order, with their variable
+    calls = sorted((node for node in ast.walk(function) if isinstance(node, ast.Call)),
+                   key=lambda call: (call.lineno, call.col_offset))
+    constructors = {}
+    for call in calls:
+        short_cls, positional = node_class(call)
+        if positional is not None:
+            constructors[call] = (short_cls, positional, assigned.get(call) or inline_variable(call, short_cls))
+
+    # Variable of a node given as an argument: its name or its inline constructor
+    def node_variable(node):
+        if isinstance(node, ast.Name):
+            return node.id
+        if isinstance(node, ast.Call) and node in constructors:
+            return constructors[node][2]
+        return None
+
+    def node_list(node):
+        if isinstance(node, (ast.List, ast.Tuple)):
+            return [v for v in (node_variable(element) for element in node.elts) if v is not None]
+        return []
+
+    for call in calls:
+        if call in constructors:
+            short_cls, positional, variable = constructors[call]
+            arguments = call_arguments(call, positional)
+
+            facts.nodes[variable] = {
+                "class": short_cls,
+                "name": literal(arguments["name"]) if "name" in arguments else None
+            }
+            child = node_variable(arguments.get("child"))
+            if child is not None:
+                facts.edges.append((variable, child))
+            for child in node_list(arguments.get("children")):
+                facts.edges.append((variable, child))
+
+            if short_cls == "Condition" and "variable" in arguments:
+                facts.condition_variables.append(literal(arguments["variable"]))
+            if "destination" in arguments:
+                facts.destinations.append(literal(arguments["destination"]))
+            if "contact" in arguments:
+                facts.contacts.append(literal(arguments["contact"]))
+
+        # Child assignments: parent.add_children([...]) / parent.add_child(child)
+        elif isinstance(call.func, ast.Attribute) and call.args:
+            parent = node_variable(call.func.value)
+            if parent is None:
+                continue
+            if call.func.attr == "add_children":
+                for child in node_list(call.args[0]):
+                    facts.edges.append((parent, child))
+            elif call.func.attr == "add_child":
+                child = node_variable(call.args[0])
+                if child is not None:
+                    facts.edges.append((parent, child))
+
+    # Root of the tree: the first node returned
+    returns = sorted((node for node in ast.walk(function) if isinstance(node, ast.Return)),
+                     key=lambda statement: statement.lineno)
+    for statement in returns:
+        root = node_variable(statement.value)
+        if root is not None:
+            facts.root = root
+            break
+
+    return facts
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+@author: smerino
+"""
+
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+
+# -------------------------------------------------------
+# LRUCache
+# -------------------------------------------------------
+# Bounded in-memory cache. When it is full, the least
+# recently used entry is evicted. Safe to use from the
+# MQTT callback thread and other threads at the same time.
+class LRUCache():
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    # Removes an entry and returns its value
+    def pop(self, key, default=None):
+        with self.lock:
+            return self.entries.pop(key, default)
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries.keys())
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+
+# -------------------------------------------------------
+# PersistentLRUCache
+# -------------------------------------------------------
+# LRUCache stored in a JSON file, so that it survives
+# restarts. Values must be JSON serializable. The file is
+# rewritten after every change, keeping the LRU order.
+class PersistentLRUCache(LRUCache):
+    def __init__(self, path, max_size=128):
+        super().__init__(max_size)
+        self.path = path
+        self.file_lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for key, value in json.load(f):
+                    super().put(key, value)
+        except Exception as e:
+            logging.error(f"Error loading cache {self.path}: {e}")
+
+    def save(self):
+        try:
+            with self.file_lock:
+                with self.lock:
+                    entries = list(self.entries.items())
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entries, f)
+                os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.error(f"Error saving cache {self.path}: {e}")
+
+    def put(self, key, value):
+        super().put(key, value)
+        self.save()
+
+    def pop(self, key, default=None):
+        value = super().pop(key, default)
+        self.save()
+        return value
+
+    def clear(self):
+        super().clear()
+        self.save()
@@ -5,136 +5,389 @@
 
 import paho.mqtt.client as mqtt
 import json
-import subprocess
+import asyncio
 import platform
 import os
 import logging
-from time import sleep
+import heapq
+import itertools
+import threading
+from Config import config
+from BT_Host import ExecutionHost, WorkerPool
+from BT_Plan import plan_name, plan_source
 
-# A plan contains the priority, user and the name of the task
+# Topic to cancel or reprioritize queued plans
+CONTROL_TOPIC = "BT_Executor/control"
+
+# A plan contains the priority, user, the name of the task and its source code
 class Plan():
-    def __init__(self, identifier, priority, user, task, correction):
+    def __init__(self, identifier, priority, user, task, correction, source=None, request_id=None):
         self.identifier = identifier     # This identifier allows us to maintain the order by priority and id
         self.priority = priority
-        self.user = user    
+        self.user = user
         self.task = task
         self.correction = correction
+        self.source = source
+        self.request_id = request_id
+        self.filename = None             # Set when the plan is written to disk
         self.active = False
+        self.stop_event = None           # Set to preempt the plan while it runs
+        self.preempted = False
+
+# Priority queue of plans, safe to use from the MQTT thread and the scheduler.
+# Corrections of a failed plan go first, then higher priorities, then older
+# plans. Insert and pop are O(log n): cancelled or reprioritized plans are only
+# marked as removed and skipped when they reach the top of the heap.
+class PlanQueue():
+    def __init__(self):
+        self.heap = []
+        self.entries = {}    # identifier -> [key, counter, plan]
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def sort_key(plan):
+        return (plan.correction != "True", -plan.priority, plan.identifier)
+
+    def push(self, plan):
+        with self.lock:
+            self._remove(plan.identifier)
+            entry = [self.sort_key(plan), next(self.counter), plan]
+            self.entries[plan.identifier] = entry
+            heapq.heappush(self.heap, entry)
+
+    # Returns the first plan without removing it (None if empty)
+    def peek(self):
+        with self.lock:
+            self._discard_removed()
+            return self.heap[0][2] if self.heap else None
+
+    # Returns the queued plan with the highest priority that is not a
+    # correction (None if there is none). Corrections go first whatever their
+    # priority, so the first plan may hide a more urgent one. O(n)
+    def peek_urgent(self):
+        with self.lock:
+            plans = [entry[2] for entry in self.entries.values() if entry[2].correction != "True"]
+        return min(plans, key=lambda plan: (-plan.priority, plan.identifier), default=None)
+
+    # Removes and returns the first plan (None if empty)
+    def pop(self):
+        with self.lock:
+            self._discard_removed()
+            if not self.heap:
+                return None
+            plan = heapq.heappop(self.heap)[2]
+            del self.entries[plan.identifier]
+            return plan
+
+    # Removes a queued plan, returns it (None if it was not queued)
+    def cancel(self, identifier):
+        with self.lock:
+            return self._remove(identifier)
+
+    # Changes the priority of a queued plan, returns False if it was not queued
+    def reprioritize(self, identifier, priority):
+        with self.lock:
+            plan = self._remove(identifier)
+            if plan is None:
+                return False
+            plan.priority = priority
+            entry = [self.sort_key(plan), next(self.counter), plan]
+            self.entries[identifier] = entry
+            heapq.heappush(self.heap, entry)
+            return True
+
+    # Queued plans in execution order
+    def plans(self):
+        with self.lock:
+            return [entry[2] for entry in sorted(self.entries.values())]
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def _remove(self, identifier):
+        entry = self.entries.pop(identifier, None)
+        if entry is None:
+            return None
+        plan = entry[2]
+        entry[2] = None
+        return plan
 
-# The planner maintains a list of queued plans or actions and executes them.    
+    def _discard_removed(self):
+        while self.heap and self.heap[0][2] is None:
+            heapq.heappop(self.heap)
+
+# Interpreter used to run the plans
+def python_command():
+    if platform.system() == 'Windows':
+        return 'python'
+    return 'python3'
+
+# The planner maintains a list of queued plans or actions and executes them.
+# It is driven by an asyncio event loop: new plans, BT output and the end of
+# the BT are events that wake the scheduler, so there is no polling.
+# Plans are run in-process by an ExecutionHost (Execution_mode: inprocess in
+# config.txt), in a pool of pre-started workers (Execution_mode: pool, with
+# Worker_pool_size workers) or as a python subprocess each (Execution_mode:
+# subprocess).
+# Plans are received as messages with the BT body and kept in memory. They are
+# only written to disk (task_{priority}_{identifier}.py) to run them as a
+# subprocess, or for auditing with Spill_plans: True, which also keeps them.
+# With Preemption: True, a plan with a higher priority than the running one
+# stops it between two ticks (py_trees stop(), which calls terminate() on the
+# running nodes). The interrupted plan is queued again from the start if
+# Requeue_preempted is True, otherwise it is dropped.
+# After a failed plan, the planner waits for its correction from
+# Failure_Interpreter for up to Correction_timeout seconds (the LLM may answer
+# with a clarification instead), then goes on with the queued plans. A queued
+# plan with a higher priority than the failed one ends the wait at once.
 class Planner():
     def __init__(self):
         self.identifier = 0
-        self.execution_queue = []
+        self.execution_queue = PlanQueue()
+        self.active_plan = None
         self.process = None
-        self.filename = None
         self.idle = True
-        self.user = None
-        self.correction = None
-    
+        execution_config = config.get('Execution', {})
+        self.execution_mode = execution_config.get('Execution_mode', 'subprocess')
+        self.preemption = execution_config.get('Preemption', 'False') == 'True'
+        self.requeue_preempted = execution_config.get('Requeue_preempted', 'True') == 'True'
+        self.spill_plans = execution_config.get('Spill_plans', 'False') == 'True'
+        self.correction_timeout = float(execution_config.get('Correction_timeout', 120))
+        self.correction_timer = None
+        self.failed_plan = None
+
+        # Warm host that runs the plans: one shared robot connection for in-process
+        # plans, or a pool of spawned workers
+        if self.execution_mode == "inprocess":
+            self.host = ExecutionHost()
+        elif self.execution_mode == "pool":
+            self.host = WorkerPool(int(config['Execution'].get('Worker_pool_size', 2)))
+        else:
+            self.host = None
+
+        # Event loop of the scheduler. Plans received in the MQTT thread are
+        # handed over to it with call_soon_threadsafe
+        self.loop = asyncio.new_event_loop()
+        self.wakeup = None
+
         # Configure MQTT broker
         broker = "your_broker"
-        port = 1884  
+        port = 1884
         username = "your_username"
         password = "your_password"
-        
+
         self.client = mqtt.Client()
         self.client.username_pw_set(username, password)
         self.client.on_message = self.on_message
         self.client.connect(broker, port)
-        
-        # Subscribe to input topic
+
+        # Subscribe to input topics
         TOPIC_IN = "BT_Planner/output"
         self.client.subscribe(TOPIC_IN)
         print("Waiting for messages on", TOPIC_IN)
-    
+        self.client.message_callback_add(CONTROL_TOPIC, self.on_control)
+        self.client.subscribe(CONTROL_TOPIC)
+
         self.client.loop_start()
-        
+
         # Configures log file "log.txt"
         logging.basicConfig(filename='log.txt', level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
-    
-    # Handles messages received on chatgpt/input
-    def on_message(self, client, userdata, msg):  
+
+    # Handles messages received on BT_Planner/output (MQTT thread)
+    def on_message(self, client, userdata, msg):
         message = json.loads(msg.payload.decode())  # Decodes JSON
-        self.correction = message.get("correction")
-        self.user = message.get("user")
-        self.filename = message.get("task")
-                
-        # Creates a plan with the task info
-        parts = self.filename.split("_")  
-        priority, identifier = parts[1], parts[2]
-        
-        # Introduces the plan into the execution queue and sorts it based on priority and counter
-        self.execution_queue.append(Plan(identifier, priority, self.user, self.filename, self.correction))
-        self.execution_queue.sort(key = lambda x: (x.correction, x.priority, x.identifier))
-        print(f"Plan queue: {self.execution_queue}")
-       
-        if self.correction == "True":
+        correction = message.get("correction")
+        user = message.get("user")
+        priority = int(message.get("priority"))
+        identifier = int(message.get("identifier"))
+
+        # Creates a plan with the task info and the complete code of the BT
+        plan = Plan(identifier, priority, user, plan_name(priority, identifier), correction,
+                    plan_source(message.get("body")), message.get("id"))
+        if self.spill_plans or self.host is None:
+            self.write_plan(plan)
+
+        # Introduces the plan into the execution queue, ordered by priority and counter
+        self.execution_queue.push(plan)
+        print(f"Plan queue: {[p.task for p in self.execution_queue.plans()]}")
+        self.loop.call_soon_threadsafe(self.plan_added, plan)
+
+    # Handles cancel and reprioritize requests for queued plans (MQTT thread):
+    # {"cancel": identifier} or {"reprioritize": identifier, "priority": priority}
+    def on_control(self, client, userdata, msg):
+        message = json.loads(msg.payload.decode())
+        if "cancel" in message:
+            plan = self.execution_queue.cancel(int(message["cancel"]))
+            print(f"Plan cancelled: {plan.task if plan else None}")
+        elif "reprioritize" in message:
+            found = self.execution_queue.reprioritize(int(message["reprioritize"]), int(message["priority"]))
+            print(f"Plan reprioritized: {found}")
+        self.loop.call_soon_threadsafe(self.queue_changed)
+
+    # Writes the plan to disk, to run it as a subprocess or for auditing
+    def write_plan(self, plan):
+        with open(plan.task, "w", encoding="utf-8") as f:
+            f.write(plan.source)
+        plan.filename = plan.task
+
+    # Removes the file of a plan that has ended, unless plans are kept for auditing
+    def remove_plan(self, plan):
+        if plan.filename is not None and not self.spill_plans and os.path.exists(plan.filename):
+            os.remove(plan.filename)
+
+    # Wakes the scheduler when a new plan is queued
+    def plan_added(self, plan):
+        if plan.correction == "True":
+            self.cancel_correction_timer()
+            self.idle = True
+        self.queue_changed()
+
+    # Frees the planner if the correction of a failed plan does not arrive
+    def correction_timed_out(self, plan):
+        self.correction_timer = None
+        self.failed_plan = None
+        print(f"No correction received for {plan.task}, resuming the queue")
+        self.idle = True
+        self.wakeup.set()
+
+    def cancel_correction_timer(self):
+        if self.correction_timer is not None:
+            self.correction_timer.cancel()
+            self.correction_timer = None
+        self.failed_plan = None
+
+    # Preempts the active plan if needed and wakes the scheduler
+    def queue_changed(self):
+        self.check_preemption()
+        self.check_correction_wait()
+        self.wakeup.set()
+
+    # Stops waiting for the correction of a failed plan if a queued plan
+    # (other than a correction) has a higher priority than the failed one.
+    # The correction is still run when it arrives
+    def check_correction_wait(self):
+        failed = self.failed_plan
+        if failed is None:
+            return
+        plan = self.execution_queue.peek_urgent()
+        if plan is None or plan.priority <= failed.priority:
+            return
+        print(f"Not waiting for the correction of {failed.task}, starting {plan.task}")
+        self.cancel_correction_timer()
+        self.idle = True
+
+    # Stops the active plan if a queued plan (other than a correction) has a
+    # higher priority. The plan ends with the preempted code and plan_ended
+    # frees the planner
+    def check_preemption(self):
+        active = self.active_plan
+        if not self.preemption or active is None or active.preempted:
+            return
+        plan = self.execution_queue.peek_urgent()
+        if plan is None or plan.priority <= active.priority:
+            return
+        print(f"Preempting plan {active.task} for {plan.task}")
+        active.preempted = True
+        if self.host is not None:
+            active.stop_event.set()
+        elif self.process is not None:
+            self.process.terminate()
+
+    # If there is no active plan, the planner executes the first one
+    async def start_next_plan(self):
+        if self.active_plan is not None or not self.idle:
+            return
+        plan = self.execution_queue.pop()
+        if plan is None:
+            return
+        try:
+            plan.stop_event = threading.Event()
+            if self.host is not None:
+                self.loop.create_task(self.run_in_host(plan))
+            else:
+                self.process = await asyncio.create_subprocess_exec(
+                    python_command(), plan.filename, stdout=asyncio.subprocess.PIPE)
+                self.loop.create_task(self.watch_plan(plan, self.process))
+            plan.active = True
+            self.active_plan = plan
+            print("Plan iniciated")
+            self.idle = False
+        except Exception as e:
+            print(f"Error while initializing plan: {e}")
+            self.execution_queue.push(plan)
+
+    # Runs the plan in the execution host or worker pool, from a worker thread
+    # so that the scheduler keeps handling events
+    async def run_in_host(self, plan):
+        returncode = await self.loop.run_in_executor(None, self.host.run_plan, plan.task, plan.source, plan.stop_event)
+        self.plan_ended(plan, returncode)
+
+    # Reads the output of a plan subprocess and handles its end
+    async def watch_plan(self, plan, process):
+        # Read output line by line
+        async for line in process.stdout:
+            line = line.decode().strip()
+            print(f"BT Status: {line}")  # Process status updates in real-time
+
+        returncode = await process.wait()
+        self.process = None
+        self.plan_ended(plan, returncode)
+
+    # Reports the end of a plan and frees the planner
+    def plan_ended(self, plan, returncode):
+        self.active_plan = None
+
+        if returncode != 0 and plan.preempted:
+            # A preempted subprocess may also end by the signal on some platforms
+            print(f"Behavior Tree preempted! (exit code {returncode})")
+            plan.active = False
+            plan.preempted = False
+            if self.requeue_preempted:
+                self.execution_queue.push(plan)
+            else:
+                self.remove_plan(plan)
+            self.idle = True
+        elif returncode == 0:
+            print("Behavior Tree completed successfully!")
+            self.remove_plan(plan)
+            topic = "plan/finished"
+            payload = json.dumps({"plan":"finished", "user": plan.user})
+            self.client.publish(topic, payload)
             self.idle = True
+        else:
+            # The planner stays busy until the corrected plan arrives, or the
+            # correction timeout expires
+            print("Behavior Tree failed!")
+            topic = "Failure_Interpreter/input"
+            self.remove_plan(plan)
+            payload = json.dumps({"filename": plan.task, "code": plan.source, "error":"-",
+                                  "user":plan.user, "id": plan.request_id})
+            self.client.publish(topic, payload)
+            self.cancel_correction_timer()
+            self.correction_timer = self.loop.call_later(self.correction_timeout, self.correction_timed_out, plan)
+            self.failed_plan = plan
+            # A plan queued while the failed one ran may not have to wait
+            self.check_correction_wait()
+        self.wakeup.set()
+
+    # Waits for events and starts the plans in the execution queue
+    async def schedule(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            await self.start_next_plan()
 
     # Executes the plans in the execution queue
     def run(self):
-        while True:
-            # print(f"Cola: {self.execution_queue}")
-            if len(self.execution_queue) > 0:
-                # If there is no active plan, the planner executes the first one as a subprocess
-                actives = sum(p.active == True for p in self.execution_queue)
-                if actives == 0 and self.idle:
-                    try:
-                       if platform.system() == 'Windows':
-                           self.process = subprocess.Popen(['python', self.execution_queue[0].task], stdout=subprocess.PIPE, text=True)
-                       elif platform.system() == 'Linux':
-                           self.process = subprocess.Popen(['python3', self.execution_queue[0].task], stdout=subprocess.PIPE, text=True)                       
-                       self.execution_queue[0].active = True
-                       print("Plan iniciated")
-                       self.idle = False
-                    except Exception as e:
-                       print(f"Error while initializing plan: {e}")
-    
-                # Looks for the active plan, in case a new one with a higher priority arrived during execution
-                for idx, x in enumerate(self.execution_queue):
-                    if x.active == True:
-                        break
-                
-                # Read output line by line
-                for line in self.process.stdout:
-                    line = line.strip()
-                    print(f"BT Status: {line}")  # Process status updates in real-time
-                
-                self.process.wait(timeout=60)
-                
-                if self.process.returncode == 0:
-                    print("Behavior Tree completed successfully!")
-                    self.process.terminate()
-                    self.process.wait(5)
-                    if self.process:
-                        print("Ending subprocess...")
-                        self.process.kill()
-                    filename = self.execution_queue[idx].task
-                    if os.path.exists(filename):
-                        os.remove(filename)
-                    topic = "plan/finished"
-                    payload = json.dumps({"plan":"finished"})
-                    self.client.publish(topic, payload)
-                    self.execution_queue.pop(idx)
-                    self.idle = True
-                    self.process.returncode = None
-                    
-                elif self.process.returncode == 1:
-                    print("Behavior Tree failed!")
-                    self.process.terminate()
-                    self.process.wait(5)                    
-                    topic = "Failure_Interpreter/input"
-                    payload = json.dumps({"filename": self.filename, "error":"-", "user":self.user})
-                    self.client.publish(topic, payload)
-                    self.execution_queue.pop(idx)
-                    self.process.returncode = None
-                else:
-                    pass
-            sleep(0.1)
-                
+        asyncio.set_event_loop(self.loop)
+        self.wakeup = asyncio.Event()
+        self.wakeup.set()
+        self.loop.run_until_complete(self.schedule())
+
 if __name__ == '__main__':
     p = Planner()
     print("Planner iniciated")
-    p.run()
\ No newline at end of file
+    p.run()
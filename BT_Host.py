@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+@author: smerino
+"""
+
+import os
+import logging
+import hashlib
+import multiprocessing
+import queue
+import py_trees
+from BT_classes import receiveTopics, TickScheduler
+from Config import config
+from BT_Cache import LRUCache
+
+# Exit code of a plan stopped by a higher priority one
+PREEMPTED = 2
+
+
+# -------------------------------------------------------
+# ExecutionHost
+# -------------------------------------------------------
+# Long-lived host that runs the plans in the current
+# interpreter instead of starting a python process per
+# plan. py_trees and BT_classes (and config.txt) are loaded
+# once, and every plan shares one receiveTopics connection
+# to the broker. The robot state is reset before each plan.
+# Compiled plans are kept in an LRU cache (Plan_cache_size in
+# config.txt), so a repeated plan is not parsed or compiled.
+class ExecutionHost():
+    def __init__(self, mqtt=None, cache_size=None):
+        if mqtt is None:
+            mqtt = receiveTopics()
+            mqtt.connect()
+        self.mqtt = mqtt
+        if cache_size is None:
+            cache_size = int(config.get('Execution', {}).get('Plan_cache_size', 32))
+        self.compiled = LRUCache(cache_size)
+
+    # Code object of a plan. The plan template is the same for every plan,
+    # so the key is in practice the hash of its create_behavior_tree body
+    def compile_plan(self, filename, source):
+        key = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        code = self.compiled.get(key)
+        if code is None:
+            code = compile(source, filename, "exec")
+            self.compiled.put(key, code)
+        return code
+
+    # Executes a plan and returns its namespace, with create_behavior_tree.
+    # The source is read from the file if it is not given. The plan is not
+    # run as __main__, so its main() is not called
+    def load_plan(self, filename, source=None):
+        if source is None:
+            with open(filename, "r", encoding="utf-8") as f:
+                source = f.read()
+        code = self.compile_plan(filename, source)
+        namespace = {"__name__": "bt_plan", "__file__": os.path.abspath(filename)}
+        exec(code, namespace)
+        return namespace
+
+    # Runs a plan until its tree ends, like the main() of the plan file.
+    # Returns the exit code the plan process would have had: 0 if the tree
+    # ended, 1 if there was an error. If stop_event is set between two ticks,
+    # the tree is stopped (terminate() of the running nodes) and PREEMPTED
+    # is returned
+    def run_plan(self, filename, source=None, stop_event=None):
+        try:
+            namespace = self.load_plan(filename, source)
+            self.mqtt.reset_state()
+            namespace["blackboard"].resultado_final = "-"
+
+            # Create the tree
+            tree = namespace["create_behavior_tree"](self.mqtt)
+
+            # Execute the tree
+            scheduler = TickScheduler(self.mqtt)
+            should_stop = stop_event.is_set if stop_event is not None else None
+            while True:
+                scheduler.tick(tree)
+                if tree.status == py_trees.common.Status.SUCCESS or tree.status == py_trees.common.Status.FAILURE:
+                    break
+                if scheduler.wait(tree, should_stop):
+                    tree.stop(py_trees.common.Status.INVALID)
+                    logging.info(f"{os.path.basename(filename)} - Plan preempted")
+                    return PREEMPTED
+            return 0
+        except Exception as e:
+            logging.error(f"{os.path.basename(filename)} - Error in main: {e}")
+            return 1
+
+
+# Main loop of a pooled worker process. The worker keeps its own
+# ExecutionHost (and broker connection) and runs the plans it
+# receives through the pipe, answering with their exit code. The pool
+# sets stop_event to preempt the running plan
+def worker_main(conn, stop_event):
+    host = ExecutionHost()
+    while True:
+        try:
+            plan = conn.recv()
+        except EOFError:
+            break
+        if plan is None:
+            break
+        filename, source = plan
+        conn.send(host.run_plan(filename, source, stop_event))
+
+
+# -------------------------------------------------------
+# WorkerPool
+# -------------------------------------------------------
+# Pool of pre-started worker processes that have already
+# imported py_trees and BT_classes and are connected to the
+# broker. Plans keep the crash isolation of a process of
+# their own, without paying the cold start. A worker that
+# dies, before or while running a plan, is replaced.
+# It has the same run_plan interface as ExecutionHost.
+# The workers are spawned rather than forked: replacements
+# are started while the broker and event loop threads of
+# the executor run, and a forked worker could inherit a
+# lock held by one of them.
+class WorkerPool():
+    def __init__(self, size):
+        self.size = size
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = queue.Queue()
+        for _ in range(size):
+            self.workers.put(self.start_worker())
+
+    def start_worker(self):
+        parent_conn, child_conn = self.context.Pipe()
+        worker_stop = self.context.Event()
+        process = self.context.Process(target=worker_main, args=(child_conn, worker_stop), daemon=True)
+        process.start()
+        child_conn.close()
+        return process, parent_conn, worker_stop
+
+    # Replaces a dead worker by a new one
+    def replace(self, worker):
+        process, conn, _ = worker
+        conn.close()
+        process.join(1)
+        logging.error(f"Plan worker {process.pid} died (exit code {process.exitcode}), starting a new one")
+        return self.start_worker()
+
+    # Runs a plan in a free worker and returns its exit code. stop_event
+    # (a threading.Event of this process) is forwarded to the worker
+    def run_plan(self, filename, source=None, stop_event=None):
+        worker = self.workers.get()
+        if not worker[0].is_alive():
+            worker = self.replace(worker)
+        process, conn, worker_stop = worker
+        try:
+            worker_stop.clear()
+            conn.send((filename, source))
+            while not conn.poll(0.1):
+                if stop_event is not None and stop_event.is_set():
+                    worker_stop.set()
+            returncode = conn.recv()
+        except (EOFError, OSError):
+            worker = self.replace(worker)
+            returncode = 1
+        self.workers.put(worker)
+        return returncode
+
+    # Stops all the workers
+    def close(self):
+        for _ in range(self.size):
+            process, conn, _ = self.workers.get()
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            process.join(1)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+@author: smerino
+"""
+
+# A plan is the create_behavior_tree() generated by the LLM (code2) embedded
+# in a complete executable structure: imports and blackboard (code1), and the
+# main loop that ticks the tree (code3). BT_Planner sends only code2, and
+# BT_Executor builds the plan in memory.
+
+code1 = """import py_trees
+from BT_classes import MoveToDestination, SpeakMessage, Reminder, Videoconference, AskQuestion, Condition, DetectFall, receiveTopics, TickScheduler
+from time import sleep
+import logging
+import os
+import sys
+import signal
+from py_trees.blackboard import Client
+from py_trees.common import Access
+
+# Configure logging
+logging.basicConfig(filename='log.txt', level=logging.INFO,
+                   format='%(asctime)s - %(levelname)s - %(message)s')
+
+filename = os.path.basename(__file__)
+
+# Register Blackboard Client
+blackboard = Client(name="BlackboardCliente")
+blackboard.register_key(key="resultado_final", access=Access.WRITE)
+"""
+
+code3 = """
+# Saves the failure
+def guardar_fallo(clase, name, e, mqtt):
+    if mqtt.resultado_BT:
+        mqtt.resultado_BT = False
+        blackboard.resultado_final = f"Error en {clase} update ({name}): {e}"
+
+# BT_Executor sends SIGTERM when a higher priority plan preempts this one
+stop_requested = False
+
+def request_stop(signum, frame):
+    global stop_requested
+    stop_requested = True
+
+def main():
+    try:
+        signal.signal(signal.SIGTERM, request_stop)
+        
+        # MQTT instance
+        mqtt = receiveTopics()
+        mqtt.connect()
+        
+        blackboard.resultado_final = "-"
+        
+        # Create the tree
+        tree = create_behavior_tree(mqtt)
+        
+        # Execute the tree, ticking it when the robot state changes or a node times out
+        scheduler = TickScheduler(mqtt)
+        while True:
+            scheduler.tick(tree)
+            if tree.status == py_trees.common.Status.SUCCESS or tree.status == py_trees.common.Status.FAILURE:
+                break
+            # Stop the running nodes and exit with the preempted code (2)
+            if scheduler.wait(tree, lambda: stop_requested):
+                tree.stop(py_trees.common.Status.INVALID)
+                sys.exit(2)
+    
+    except Exception as e:
+        logging.error(f\"{filename} - Error in main: {e}\")
+        sys.exit(1)
+
+if __name__ == \"__main__\":
+    main()
+"""
+
+# Name of a plan, also its file name when it is written to disk
+def plan_name(priority, identifier):
+    return f"task_{priority}_{identifier}.py"
+
+# Complete source of a plan
+def plan_source(code2):
+    return code1 + code2 + code3
@@ -4,10 +4,14 @@
 """
 
 import paho.mqtt.client as mqtt
-import subprocess
 import json
-import os
 import re
+import uuid
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from BT_Validator import validate_bt, VALIDATOR_VERSION
+from BT_Analyzer import analyse_bt, remove_try_except, bt_hash
+from BT_Cache import PersistentLRUCache
 
 # Configure MQTT broker
 broker = "your_broker"
@@ -17,72 +21,117 @@ password = "your_password"
 
 TOPIC_IN = "BT_Tester/input"
 
-def remove_try_except(bt_code):
-    # Remove the try/except block from create_behavior_tree 
-    pattern = r"def create_behavior_tree\(.*?\):\s*try:\s*((?:\n\s+.+)+?)\n\s*except.*?:\s*((?:\n\s+.+)+?)"
-    match = re.search(pattern, bt_code)
-    if match:
-        body = match.group(1)
-        return f"def create_behavior_tree(mqtt):{body}\n"
-    return bt_code  # If there is no try/except, returns the original
+# Validation mode of validate_bt ("coverage" or "exhaustive")
+VALIDATION_MODE = "coverage"
 
-def on_message(client, userdata, msg):
-    # Handles messages received on chatgpt/input
-    message = json.loads(msg.payload.decode())  # Decode JSON
+# Verdicts of already validated BTs, keyed by the validator version, the mode
+# and the normalized hash of their code
+CACHE_FILE = "BT_Tester_cache.json"
+CACHE_SIZE = 256
+validation_cache = PersistentLRUCache(CACHE_FILE, CACHE_SIZE)
+
+# Validations run in a pool of workers, outside the MQTT network thread
+WORKERS = 4
+executor = ThreadPoolExecutor(max_workers=WORKERS)
+
+# Correlation ids are uuid4 hex strings (Mqtt_receiver). As the id names the
+# scratch file of a failed test, any other id is replaced by a new one
+REQUEST_ID = re.compile(r"[0-9a-f]{32}")
+
+def request_id_of(message):
+    request_id = message.get("id")
+    if isinstance(request_id, str) and REQUEST_ID.fullmatch(request_id):
+        return request_id
+    if request_id is not None:
+        print(f"Invalid request id {request_id!r}, using a new one")
+    return uuid.uuid4().hex
+
+# Sends a failed BT to Failure_Interpreter, in a scratch file of the request
+def publish_failure(client, user, bt_code, error, request_id):
+    filename = f"BT_Tester_fail_{request_id}.py"
+    with open(filename, "w") as f:
+        f.write(bt_code or "")
+
+    topic = "Failure_Interpreter/input"
+    payload = json.dumps({"filename": filename, "error": error, "user": user, "id": request_id})
+    client.publish(topic, payload)
+
+# Validates one BT and publishes the result. Every request has its own
+# correlation id, used to name its scratch files and sent with the result
+def validate_request(client, message, request_id):
     correction = message.get("correction")
     user = message.get("user")
     bt_code = message.get("response")
     
     test_bt_code = remove_try_except(bt_code)
-    # Executes the test_bt
-    result = subprocess.run(
-        ["pytest", "-s", "test_bt.py", f"--bt-code={test_bt_code}"],
-        capture_output=True,
-        text=True
-    )
-    
-    print("STDOUT:\n", result.stdout)
-    print("STDERR:\n", result.stderr)
-    
-    result_data = {}
-    try:
-        with open("result.json", "r", encoding="utf-8") as f:
-            result_data = json.load(f)
-            test_result = result_data["result"]
-            test_error = result_data["error"]
-            
-        # Publishes in topic according to result
-        if test_result == "PASSED":
-            topic = "BT_Planner/input"
-            payload = json.dumps({"correction":correction, "user": user, "response": bt_code})
-
+    key = f"{VALIDATOR_VERSION}|{VALIDATION_MODE}|{bt_hash(test_bt_code)}"
+    result_data = validation_cache.get(key)
+    if result_data is not None:
+        print("Verdict found in cache")
+    else:
+        # Validates the BT in-process. Its structural facts let the validator
+        # reject duplicated node names without executing the code. Code that
+        # cannot be analysed fails without being run (and is not cached)
+        analysis_error = None
+        try:
+            facts = analyse_bt(bt_code)
+        except SyntaxError:
+            facts = None
+        except Exception as e:
+            analysis_error = e
+        if analysis_error is not None:
+            result_data = {"result": "FAILED", "error": f"Error in code: {analysis_error}", "runs": 0}
         else:
-            filename = "BT_Tester_fail.py"
-            with open(filename, "w") as f:
-                f.write(bt_code)
-            
-            topic = "Failure_Interpreter/input"
-            payload = json.dumps({"filename": filename, "error": test_error, "user": user})
+            result_data = validate_bt(test_bt_code, mode=VALIDATION_MODE, facts=facts)
+            validation_cache.put(key, {"result": result_data["result"], "error": result_data["error"],
+                                       "runs": result_data["runs"]})
+    test_result = result_data["result"]
+    test_error = result_data["error"]
+        
+    # Publishes in topic according to result
+    if test_result == "PASSED":
+        topic = "BT_Planner/input"
+        payload = json.dumps({"correction":correction, "user": user, "response": bt_code, "id": request_id})
+        client.publish(topic, payload)
+    else:
+        publish_failure(client, user, bt_code, test_error, request_id)
         
-        client.publish(topic, payload)    
-            
-        print("\n Test result:", test_result)
-        if test_error:
-            print(" Error type:", test_error)
-    except FileNotFoundError:
-        print("result.json not found.")
-    finally:
-        if os.path.exists("result.json"):
-            os.remove("result.json")
-
-# Configure MQTT client
-client = mqtt.Client()
-client.username_pw_set(username, password)
-client.on_message = on_message
-client.connect(broker, port)
-
-# Subscribe to input topic
-client.subscribe(TOPIC_IN)
-print("Waiting for messages on", TOPIC_IN)
-
-client.loop_forever()
\ No newline at end of file
+    print(f"\n [{request_id}] Test result:", test_result)
+    print(" Combinations run:", result_data["runs"])
+    if test_error:
+        print(" Error type:", test_error)
+
+# Runs a validation job. If it crashes, the BT is reported as failed with the
+# error, so that the request does not stall, and the traceback is printed
+# since the pool would hide it
+def run_job(client, message):
+    request_id = request_id_of(message)
+    try:
+        validate_request(client, message, request_id)
+    except Exception as e:
+        traceback.print_exc()
+        try:
+            publish_failure(client, message.get("user"), message.get("response"),
+                            f"Error validating the BT: {e}", request_id)
+        except Exception:
+            traceback.print_exc()
+
+def on_message(client, userdata, msg):
+    # Handles messages received on BT_Tester/input
+    message = json.loads(msg.payload.decode())  # Decode JSON
+    executor.submit(run_job, client, message)
+
+# The client is only started when the module is run, as the spawned workers
+# of the validator import the main module again
+if __name__ == '__main__':
+    # Configure MQTT client
+    client = mqtt.Client()
+    client.username_pw_set(username, password)
+    client.on_message = on_message
+    client.connect(broker, port)
+
+    # Subscribe to input topic
+    client.subscribe(TOPIC_IN)
+    print("Waiting for messages on", TOPIC_IN)
+
+    client.loop_forever()
\ No newline at end of file
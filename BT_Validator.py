@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+"""
+@author: smerino
+"""
+
+import py_trees
+import itertools
+import logging
+import multiprocessing
+from collections import Counter
+from BT_Analyzer import remove_try_except
+
+# Status aliases for readability
+SUCCESS = py_trees.common.Status.SUCCESS
+FAILURE = py_trees.common.Status.FAILURE
+RUNNING = py_trees.common.Status.RUNNING
+
+# Safety limit to avoid infinite loops when ticking a tree
+MAX_TICKS = 20
+
+# Version of the validation rules. Change it when they change, so that the
+# verdicts cached by BT_Tester are not reused
+VALIDATOR_VERSION = 1
+
+# -------------------------------------------------------
+# DummyNode
+# -------------------------------------------------------
+# A simple replacement node that mimics a BT behaviour.
+# Instead of real logic, it returns its result from the
+# current outcome vector of the DummyBT that owns it
+# (SUCCESS/FAILURE). This allows exhaustive testing
+# without executing real robot actions.
+class DummyNode(py_trees.behaviour.Behaviour):
+    def __init__(self, name, index, bt):
+        super().__init__(name)
+        self.index = index
+        self.bt = bt
+
+    def update(self):
+        self.bt.tick_log.append(self.name)  # keep track of execution order
+        return self.bt.outcomes[self.index]
+
+
+# -------------------------------------------------------
+# DummyBT
+# -------------------------------------------------------
+# Runnable version of a generated BT with DummyNodes
+# instead of real action nodes. The code is compiled once.
+# If every node of the tree is stateless (is_stateless),
+# the tree is also built once and every run just swaps the
+# outcome vector of the DummyNodes and resets the tree.
+# Otherwise (e.g. a OneShot decorator, which stop() does not
+# reset) the tree is built again for every run.
+class DummyBT():
+    def __init__(self, bt_code_str):
+        self.bt_code = bt_code_str
+        self.outcomes = []
+        self.tick_log = []
+        self.code = compile(bt_code_str, "<create_behavior_tree>", "exec")
+        self.build()
+        self.stateless = all(is_stateless(node) for node in self.bt_runner.root.iterate())
+
+    # Builds the tree from the compiled code
+    def build(self):
+        self.nodes = []
+
+        def dummy_factory(name, **kwargs):
+            node = DummyNode(name, len(self.nodes), self)
+            self.nodes.append(node)
+            return node
+
+        # Override environment so that BT code uses dummy constructors
+        exec_env = {
+            "py_trees": py_trees,
+            "MoveToDestination": dummy_factory,
+            "SpeakMessage": dummy_factory,
+            "Reminder": dummy_factory,
+            "AskQuestion": dummy_factory,
+            "Condition": dummy_factory,
+            "Videoconference": dummy_factory,
+            "Alert": dummy_factory,
+            "DetectFall": dummy_factory,
+            "mqtt": None,
+            "logging": logging
+        }
+
+        exec(self.code, exec_env)
+        tree = exec_env['create_behavior_tree'](mqtt=None)
+        self.bt_runner = py_trees.trees.BehaviourTree(root=tree)
+        self.bt_runner.setup()
+
+    # Names of the action nodes, in declaration order
+    def node_names(self):
+        return [node.name for node in self.nodes]
+
+    # Ticks the tree with the given outcome vector until it
+    # finishes (or MAX_TICKS is reached) and returns the names
+    # of the nodes that were ticked
+    def run(self, outcomes):
+        self.outcomes = outcomes
+        self.tick_log = []
+        # Reset the tree left by the previous run
+        if self.stateless:
+            self.bt_runner.root.stop(py_trees.common.Status.INVALID)
+        else:
+            self.build()
+
+        for _ in range(MAX_TICKS):
+            self.bt_runner.tick()
+            if self.bt_runner.root.status != RUNNING:
+                break
+
+        return self.tick_log
+
+
+# Nodes whose state is fully reset by stop()
+def is_stateless(node):
+    return (isinstance(node, DummyNode) or type(node) in CONSTANT_BEHAVIOURS
+            or type(node) in STATUS_DECORATORS or type(node) in COMPOSITES)
+
+
+# -------------------------------------------------------
+# exhaustive_search
+# -------------------------------------------------------
+# Ticks the tree for every combination of SUCCESS/FAILURE
+# outcomes of its n nodes (up to 2^n runs), stopping as soon
+# as every node has been ticked. Returns the ticked nodes and
+# the number of combinations that were run.
+def exhaustive_search(bt):
+    all_nodes = set(bt.node_names())
+    ticked_total = set()
+    runs = 0
+    for combo in itertools.product([SUCCESS, FAILURE], repeat=len(bt.nodes)):
+        ticked_total.update(bt.run(combo))
+        runs += 1
+        if ticked_total >= all_nodes:
+            break
+    return ticked_total, runs
+
+
+# Outcome vector of the combination with the given index, in
+# the same order as itertools.product([SUCCESS, FAILURE], repeat=n)
+def combination(index, n):
+    return [FAILURE if index >> (n - 1 - k) & 1 else SUCCESS for k in range(n)]
+
+
+# DummyBT of each worker process, built once by init_worker
+worker_bt = None
+
+
+def init_worker(bt_code):
+    global worker_bt
+    worker_bt = DummyBT(bt_code)
+
+
+# Ticks the tree for the combinations in [start, stop), stopping
+# as soon as all nodes were ticked. Returns the ticked nodes and
+# the number of combinations that were run.
+def sweep_shard(shard):
+    start, stop = shard
+    n = len(worker_bt.nodes)
+    all_nodes = set(worker_bt.node_names())
+    ticked = set()
+    runs = 0
+    for index in range(start, stop):
+        ticked.update(worker_bt.run(combination(index, n)))
+        runs += 1
+        if ticked >= all_nodes:
+            break
+    return ticked, runs
+
+
+# -------------------------------------------------------
+# parallel_search
+# -------------------------------------------------------
+# Same sweep as exhaustive_search, split into shards of
+# combinations that are ticked by a pool of worker
+# processes. The ticked sets of the shards are merged as
+# they arrive, and the pool is terminated as soon as every
+# node has been ticked. The workers are spawned rather than
+# forked, as a forked worker could inherit a lock held by
+# another thread of the caller and hang.
+# Spawned workers import the main module again, so it must
+# only start its MQTT client under a __main__ guard.
+def parallel_search(bt, workers):
+    n = len(bt.nodes)
+    all_nodes = set(bt.node_names())
+    total = 2 ** n
+    shard_size = max(1, total // (workers * 16))
+    shards = [(start, min(start + shard_size, total)) for start in range(0, total, shard_size)]
+
+    ticked_total = set()
+    runs_total = 0
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers, initializer=init_worker, initargs=(bt.bt_code,)) as pool:
+        for ticked, runs in pool.imap_unordered(sweep_shard, shards):
+            ticked_total.update(ticked)
+            runs_total += runs
+            if ticked_total >= all_nodes:
+                break
+    return ticked_total, runs_total
+
+
+# -------------------------------------------------------
+# LazyOutcomes
+# -------------------------------------------------------
+# Outcome vector used by pruned_search. The outcome of a
+# node is only decided when it is ticked for the first time:
+# it comes from the prefix if it was fixed by a previous
+# run, otherwise it defaults to SUCCESS and is recorded as
+# a new decision.
+class LazyOutcomes():
+    def __init__(self, prefix):
+        self.prefix = dict(prefix)
+        self.decided = []
+
+    def __getitem__(self, index):
+        if index not in self.prefix:
+            self.prefix[index] = SUCCESS
+            self.decided.append(index)
+        return self.prefix[index]
+
+
+# -------------------------------------------------------
+# pruned_search
+# -------------------------------------------------------
+# Depth-first search over the outcomes of the nodes that
+# are actually ticked. Outcomes of nodes that are never
+# reached cannot change which nodes get ticked, so those
+# prefixes are never expanded. Stops as soon as every node
+# has been ticked.
+def pruned_search(bt):
+    all_nodes = set(bt.node_names())
+    ticked_total = set()
+    runs = 0
+    pending = [{}]
+    while pending:
+        prefix = pending.pop()
+        outcomes = LazyOutcomes(prefix)
+        ticked_total.update(bt.run(outcomes))
+        runs += 1
+        if ticked_total >= all_nodes:
+            break
+
+        # Branch on every outcome decided during this run
+        fixed = dict(prefix)
+        for index in outcomes.decided:
+            pending.append({**fixed, index: FAILURE})
+            fixed[index] = SUCCESS
+    return ticked_total, runs
+
+
+# Raised by node_outcomes for nodes whose semantics it does not know
+class UnsupportedNode(Exception):
+    pass
+
+
+# Decorators that only translate the status of their child
+STATUS_DECORATORS = {
+    py_trees.decorators.Inverter: {SUCCESS: FAILURE, FAILURE: SUCCESS},
+    py_trees.decorators.FailureIsSuccess: {FAILURE: SUCCESS},
+    py_trees.decorators.FailureIsRunning: {FAILURE: RUNNING},
+    py_trees.decorators.SuccessIsFailure: {SUCCESS: FAILURE},
+    py_trees.decorators.SuccessIsRunning: {SUCCESS: RUNNING},
+    py_trees.decorators.RunningIsFailure: {RUNNING: FAILURE},
+    py_trees.decorators.RunningIsSuccess: {RUNNING: SUCCESS},
+    py_trees.decorators.PassThrough: {}
+}
+
+# Behaviours that always return the same status
+CONSTANT_BEHAVIOURS = {
+    py_trees.behaviours.Success: SUCCESS,
+    py_trees.behaviours.Failure: FAILURE,
+    py_trees.behaviours.Running: RUNNING,
+    py_trees.behaviours.Dummy: RUNNING
+}
+
+COMPOSITES = {py_trees.composites.Sequence, py_trees.composites.Selector, py_trees.composites.Parallel}
+
+
+# -------------------------------------------------------
+# node_outcomes
+# -------------------------------------------------------
+# Static analysis of the Sequence, Selector, Parallel and
+# decorator semantics. Returns the set of statuses a node
+# can end with once it is ticked, and adds to ticked the
+# names of every DummyNode that can be ticked below it.
+# Every DummyNode appears once in the tree and its outcome
+# is free, so the outcomes of sibling subtrees are
+# independent. A RUNNING child keeps returning RUNNING on
+# every tick, so it stops its parent like a final status.
+def node_outcomes(node, ticked):
+    if isinstance(node, DummyNode):
+        ticked.add(node.name)
+        return {SUCCESS, FAILURE}
+
+    if type(node) in CONSTANT_BEHAVIOURS:
+        return {CONSTANT_BEHAVIOURS[type(node)]}
+
+    if type(node) in STATUS_DECORATORS:
+        mapping = STATUS_DECORATORS[type(node)]
+        return {mapping.get(status, status) for status in node_outcomes(node.decorated, ticked)}
+
+    # A Sequence moves on while its children succeed
+    if type(node) is py_trees.composites.Sequence:
+        return chain_outcomes(node.children, SUCCESS, ticked)
+
+    # A Selector moves on while its children fail
+    if type(node) is py_trees.composites.Selector:
+        return chain_outcomes(node.children, FAILURE, ticked)
+
+    # A Parallel ticks all of its children
+    if type(node) is py_trees.composites.Parallel:
+        node.validate_policy_configuration()
+        if not node.children:
+            return {SUCCESS}
+        children_outcomes = [node_outcomes(child, ticked) for child in node.children]
+        return {parallel_status(node, combo) for combo in itertools.product(*children_outcomes)}
+
+    raise UnsupportedNode(type(node).__name__)
+
+
+# Outcomes of a Sequence (continue_status SUCCESS) or a Selector (FAILURE)
+def chain_outcomes(children, continue_status, ticked):
+    outcomes = set()
+    for child in children:
+        child_outcomes = node_outcomes(child, ticked)
+        outcomes |= child_outcomes - {continue_status}
+        if continue_status not in child_outcomes:
+            return outcomes
+    outcomes.add(continue_status)
+    return outcomes
+
+
+# Status of a Parallel for one combination of children statuses
+def parallel_status(node, combo):
+    if FAILURE in combo:
+        return FAILURE
+    policy = node.policy
+    if isinstance(policy, py_trees.common.ParallelPolicy.SuccessOnAll):
+        succeeded = all(status == SUCCESS for status in combo)
+    elif isinstance(policy, py_trees.common.ParallelPolicy.SuccessOnOne):
+        succeeded = SUCCESS in combo
+    else:
+        selected = [status for child, status in zip(node.children, combo) if child in policy.children]
+        succeeded = all(status == SUCCESS for status in selected)
+    return SUCCESS if succeeded else RUNNING
+
+
+# -------------------------------------------------------
+# coverage_search
+# -------------------------------------------------------
+# Finds the nodes that can be ticked without enumerating
+# the 2^n outcome combinations. The tree is analysed with
+# node_outcomes; if it uses a node whose semantics are
+# unknown, it falls back to pruned_search. Returns the
+# ticked nodes and the number of combinations that were run
+# (none for the static analysis).
+def coverage_search(bt):
+    ticked_total = set()
+    try:
+        node_outcomes(bt.bt_runner.root, ticked_total)
+    except UnsupportedNode as e:
+        print(f"Unsupported node {e}, using pruned search")
+        return pruned_search(bt)
+    return ticked_total, 0
+
+
+# -------------------------------------------------------
+# validate_bt
+# -------------------------------------------------------
+# In-process validation of a generated BT.
+# 0. If the BTFacts of the code are given (analyse_bt) and
+#    they already show duplicated node names, fail without
+#    executing the code.
+# 1. Build the dummy BT once and get its action node names.
+# 2. Find the nodes that can be ticked, either with the
+#    coverage search (default) or by ticking the tree for
+#    every SUCCESS/FAILURE combination (mode="exhaustive",
+#    split among several processes if workers > 1).
+# 3. Validate:
+#    - No duplicate node names (checked before ticking anything)
+#    - All nodes were ticked in at least one run
+# Returns the verdict as a dictionary with the keys "result"
+# ("PASSED"/"FAILED"), "error", "nodes", "ticked" and "runs"
+# (number of outcome combinations that were ticked).
+def validate_bt(bt_code, mode="coverage", workers=1, facts=None):
+    defined_node_names = []
+    ticked_total = set()
+    runs = 0
+
+    # Names that are not literals are only known once the code runs
+    if facts is not None and None not in facts.action_names():
+        node_counts = Counter(facts.action_names())
+        duplicated_nodes = [name for name, count in node_counts.items() if count > 1]
+        if duplicated_nodes:
+            return {
+                "result": "FAILED",
+                "error": f"Duplicated node names: {sorted(duplicated_nodes)}",
+                "nodes": facts.action_names(),
+                "ticked": [],
+                "runs": 0
+            }
+
+    try:
+        bt_code_clean = remove_try_except(bt_code)
+        print("Without try-except:", bt_code_clean)
+        bt = DummyBT(bt_code_clean)
+        defined_node_names = bt.node_names()
+        print(f"TOTAL nodes detected: {len(defined_node_names)}")
+        print(f"NODES: {defined_node_names}")
+
+        # Detect duplicated node names, no need to tick the tree if there are
+        node_counts = Counter(defined_node_names)
+        duplicated_nodes = [name for name, count in node_counts.items() if count > 1]
+
+        if not duplicated_nodes:
+            if mode == "exhaustive" and workers > 1:
+                ticked_total, runs = parallel_search(bt, workers)
+            elif mode == "exhaustive":
+                ticked_total, runs = exhaustive_search(bt)
+            else:
+                ticked_total, runs = coverage_search(bt)
+            print(f"Combinations run: {runs} of {2 ** len(defined_node_names)}")
+
+        # Detect nodes that were never ticked
+        missing_nodes = list(set(defined_node_names) - ticked_total)
+
+        if duplicated_nodes:
+            result = "FAILED"
+            error = f"Duplicated node names: {sorted(duplicated_nodes)}"
+        elif missing_nodes:
+            result = "FAILED"
+            error = f"Some nodes were never ticked in any test run: {sorted(missing_nodes)}"
+        else:
+            result = "PASSED"
+            error = ""
+
+    except Exception as e:
+        result = "FAILED"
+        error = f"Error in code: {e}"
+
+    return {
+        "result": result,
+        "error": error,
+        "nodes": defined_node_names,
+        "ticked": sorted(ticked_total),
+        "runs": runs
+    }
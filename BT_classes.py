@@ -14,9 +14,11 @@ from py_trees.blackboard import Client
 import json
 import random
 import logging
+import threading
 import paho.mqtt.client as mqtt
 import smtplib
 from email.message import EmailMessage
+from Config import config
 
 # Configure the log to send messages to a log.txt file
 logging.basicConfig(filename='log.txt', level=logging.INFO,
@@ -25,66 +27,167 @@ logging.basicConfig(filename='log.txt', level=logging.INFO,
 
 # ----------------------------- Utilities -----------------------------
 
-# Function to read configuration data
-def read_config(file):
-    try:
-        config = {}
-        with open(file, 'r', encoding='utf-8') as f:
-            current_section = None
-            for line in f:
-                line = line.strip()
-                if line:
-                    if ':' in line:
-                        key, value = line.split(':', 1)
-                        key = key.strip()
-                        value = value.strip()
-                        if current_section:
-                            config[current_section][key] = value
-                        else:
-                            config[key] = value
-                    else:
-                        current_section = line
-                        config[current_section] = {}
-        return config
-    except Exception as e:
-        logging.error(f"Error reading config: {e}")
-
-
-# Extract information from config file
-file = 'config.txt'  
-config = read_config(file)
-
-
 # Register Blackboard client
 blackboard = Client(name="BlackboardClient")
 blackboard.register_key(key="final_result", access=Access.WRITE)
 
 filename = os.path.basename(__file__)
 
+# Robot state shared by the MQTT thread and the BT nodes. Every field has a
+# version, that changes when its value changes. Writes are made under a
+# lock, and callers can wait for changes (wait_for_change), subscribe to
+# them, or read and write a field atomically (swap, compare_and_set) so
+# that an update of the MQTT thread is not lost by a node that clears it.
+# The thread that made the last change of each field is kept, so that the
+# changes made by the BT itself can be told apart from robot messages.
+class RobotState():
+    # Fields and their initial values
+    FIELDS = {
+        "robot_status": "",
+        "robot_command": "",
+        "room_mqtt": "",
+        "location_mqtt": "",
+        "status_description_id": "",
+        "interaction_positioning": False,
+        "previous_status": "",
+        "response": "",          # User’s response
+        "menu": "",              # Current screen menu
+        "responseGPT": "",
+        "speaking": "",          # When robot finishes speaking
+        "answer": "",
+        "usage_timer": 0,        # Reset to time() when user interacts
+        "end_call": False,
+        "camera_error": False,
+        "BT_result": True,
+        "result_description": None,
+        "person_state": None,
+        "fall_result_received": False
+    }
+    __slots__ = tuple(FIELDS) + ("versions", "writers", "version_counter", "changed", "subscribers")
+
+    def __init__(self):
+        self.versions = {}
+        self.writers = {}
+        self.version_counter = 0
+        self.changed = threading.Condition()
+        self.subscribers = []
+        for key, value in self.FIELDS.items():
+            setattr(self, key, value)
+            self.versions[key] = 0
+            self.writers[key] = None
+
+    # Sets several fields at once. Only the fields whose value changes get a
+    # new version and are notified
+    def update(self, **values):
+        with self.changed:
+            changes = {}
+            for key, value in values.items():
+                if key not in self.FIELDS:
+                    raise AttributeError(f"Unknown robot state field: {key}")
+                if getattr(self, key) != value:
+                    setattr(self, key, value)
+                    self.version_counter += 1
+                    self.versions[key] = self.version_counter
+                    self.writers[key] = threading.get_ident()
+                    changes[key] = value
+            if changes:
+                self.changed.notify_all()
+            subscribers = list(self.subscribers)
+        for keys, callback in subscribers:
+            for key, value in changes.items():
+                if keys is None or key in keys:
+                    callback(key, value)
+
+    def set(self, key, value):
+        self.update(**{key: value})
+
+    def get(self, key):
+        return getattr(self, key)
+
+    # Sets all the fields to their initial values
+    def reset(self):
+        self.update(**self.FIELDS)
+
+    # Sets a field and returns its previous value
+    def swap(self, key, value):
+        with self.changed:
+            previous = getattr(self, key)
+            self.update(**{key: value})
+            return previous
+
+    # Sets a field only if it still has the expected value
+    def compare_and_set(self, key, expected, value):
+        with self.changed:
+            if getattr(self, key) != expected:
+                return False
+            self.update(**{key: value})
+            return True
+
+    # Version of a field, or of the whole state
+    def version(self, key=None):
+        with self.changed:
+            if key is None:
+                return self.version_counter
+            return self.versions[key]
+
+    # True if one of the keys (any field if None) changed after the given
+    # version. The changes last made by the ignored thread are not counted
+    def changed_since(self, version, keys=None, ignore_thread=None):
+        with self.changed:
+            return self.has_changed(version, keys, ignore_thread)
+
+    def has_changed(self, version, keys, ignore_thread):
+        if keys is None and ignore_thread is None:
+            return self.version_counter > version
+        return any(self.versions[key] > version and self.writers[key] != ignore_thread
+                   for key in (self.FIELDS if keys is None else keys))
+
+    # Waits until one of the keys (any field if None) changes after the given
+    # version, not counting the changes of ignore_thread. Returns True if it
+    # changed, False on timeout
+    def wait_for_change(self, version, timeout=None, keys=None, ignore_thread=None):
+        with self.changed:
+            return self.changed.wait_for(lambda: self.has_changed(version, keys, ignore_thread), timeout)
+
+    # callback(key, value) is called, from the thread that makes the change,
+    # when one of the keys (any field if None) changes
+    def subscribe(self, callback, keys=None):
+        with self.changed:
+            self.subscribers.append((keys, callback))
+
+    def unsubscribe(self, callback):
+        with self.changed:
+            self.subscribers = [(k, c) for k, c in self.subscribers if c != callback]
+
+    def snapshot(self):
+        with self.changed:
+            return {key: getattr(self, key) for key in self.FIELDS}
+
+
 # Class that connects to the MQTT broker and receives robot messages
 class receiveTopics():
     def __init__(self):
         # Variables
         global config
         self.topic_header = "robot/Temi_UVA"
-        self.robot_status = ""
-        self.robot_command = ""
-        self.room_mqtt = ""
-        self.location_mqtt = ""
-        self.status_description_id = ""
-        self.interaction_positioning = False
-        self.previous_status = ""
-        self.response = ""   # User’s response        
-        self.menu = ""       # Current screen menu
-        self.responseGPT = ""
-        self.speaking = ""   # When robot finishes speaking
-        self.answer = ""
-        self.usage_timer = 0 # Reset to time() when user interacts
-        self.end_call = False
-        self.camera_error = False
-        self.BT_result = True
-        self.result_description = None
-        self.person_state = None
+        self.state = RobotState()
+        self.mqtt_client = None
+
+        # Handlers of the robot topics
+        self.handlers = {}
+        self.register_handler("/output/info/movement/status", self.on_movement_status)
+        self.register_handler("/output/info/movement/position", self.on_position)
+        self.register_handler("/output/info/button", self.on_button)
+        self.register_handler("/output/info/media/speak", self.on_speak)
+        self.register_handler("/output/info/answer", self.on_answer)
+        self.register_handler("/output/info/interaction", self.on_interaction, decode=False)
+        self.register_handler("/output/info/media/videoconf", self.on_videoconf)
+        self.register_handler("/output/info/menu", self.on_menu)
+        self.register_handler("/output/info/person_found_state", self.on_person_found_state)
+
+    # Resets the robot state, so that one connection can be shared by several plans
+    def reset_state(self):
+        self.state.reset()
             
     def connect(self):
         try:
@@ -98,19 +201,12 @@ class receiveTopics():
             self.mqtt_client.username_pw_set(username, password)
             self.mqtt_client.connect(broker, port)
             
-            # Define necessary topics
-            self.topic1 = self.topic_header + "/output/info/movement/status"    
-            self.topic2 = self.topic_header + "/output/info/movement/position"  
-            self.topic3 = self.topic_header + "/output/info/button"             
-            self.topic4 = self.topic_header + "/output/info/media/speak"
-            self.topic5 = self.topic_header + "/output/info/answer"  
-            self.topic6 = self.topic_header + "/output/info/interaction"  
-            self.topic7 = self.topic_header + "/output/info/media/videoconf"  
-            self.topic8 = self.topic_header + "/output/info/menu"  
-            self.topic10 = self.topic_header + "/output/info/person_found_state"  
+            # Robot topics, dispatched by process_message
             self.topicGeneral = self.topic_header + "/output/info/#"
             self.mqtt_client.message_callback_add(self.topicGeneral, self.process_message)
             self.mqtt_client.subscribe(self.topicGeneral)
+            for topic in self.handlers:
+                self.subscribe_handler(topic)
             self.mqtt_client.loop_start()
         except Exception as e:
             logging.error(f"{filename} - Error connecting to MQTT: {e}")
@@ -131,83 +227,189 @@ class receiveTopics():
         except Exception as e:
             logging.error(f"{filename} - Error disconnecting from BT: {e}") 
                         
-    # Handle robot MQTT messages 
+    # Registers the handler of a robot topic (relative to topic_header). The
+    # handler receives the decoded JSON payload, or the raw payload if decode
+    # is False. Topics outside /output/info/ are subscribed when connected
+    def register_handler(self, topic, handler, decode=True):
+        topic = self.topic_header + topic
+        self.handlers[topic] = (handler, decode)
+        if self.mqtt_client is not None:
+            self.subscribe_handler(topic)
+
+    def subscribe_handler(self, topic):
+        if not topic.startswith(self.topic_header + "/output/info/"):
+            self.mqtt_client.message_callback_add(topic, self.process_message)
+            self.mqtt_client.subscribe(topic)
+
+    # Handle robot MQTT messages: the payload is decoded once and passed to
+    # the handler of the topic. Topics without handler are ignored
     def process_message(self, client, userdata, message):
-        topic = message.topic
-        if topic == self.topic_header + "/output/info/imagen":
-            payload = message.payload
-        else:
-            payload = message.payload.decode("utf-8")
-        
-        # Movement status
-        if topic == self.topic1:
-            data = json.loads(payload)            
-            if "status" and "command" and "descriptionId" in data:
-                self.robot_status = str(data["status"])
-                if self.robot_status == "abort" and self.previous_status == "reposing":
-                    self.interaction_positioning = True
-                self.previous_status = self.robot_status
-                self.robot_command = str(data["command"])
-                self.status_description_id = str(data["descriptionId"])
-                
-        # Robot position                   
-        if topic == self.topic2:
-            data = json.loads(payload)
-            if "location" in data:
-                self.location_mqtt = data["location"]
-            if "room" in data:
-                self.room_mqtt = data["room"]
-               
-        # Pause button response           
-        if topic == self.topic3:
-            data = json.loads(payload)
-            if "status" in data:
-                self.response = str(data["status"])
-
-        # Robot speaking        
-        if topic == self.topic4:
-            data = json.loads(payload)
-            if "status" in data:
-                self.speaking = str(data["status"])
-                
-        # User’s answer
-        if topic == self.topic5:
-            data = json.loads(payload)
-            if "texto" in data:
-                self.response = str(data["text"].strip("[]"))
-
-        # User interaction with robot        
-        if topic == self.topic6:
-            self.usage_timer = time()
-        
-        # End video call
-        if topic == self.topic7:
-            data = json.loads(payload)
-            if "status" in data:
-                if str(data["status"]) == "ended":
-                    self.end_call = True  
-        
-        # Robot menu
-        if topic == self.topic8:
-            data = json.loads(payload)
-            if "menu" in data:
-                self.menu = str(data["menu"])
-         
-        # Fall detection result
-        if topic == self.topic10:  
-            if not self.fall_result_received:
-                data = json.loads(payload)
-                if "fallen" and "not_fallen" in data:
-                    
-                    if int(data["fallen"]) > 0:
-                        self.person_state = "fallen"
-                        self.fall_result_received = True
-                    elif int(data["not_fallen"]) > 0:
-                        self.person_state = "not_fallen"
-                        self.fall_result_received = True
-                    else:
-                        self.person_state = "nobody"   # cambiar
-                        self.fall_result_received = True 
+        entry = self.handlers.get(message.topic)
+        if entry is None:
+            return
+        handler, decode = entry
+        try:
+            data = json.loads(message.payload) if decode else message.payload
+            handler(data)
+        except Exception as e:
+            logging.error(f"{filename} - Error processing {message.topic}: {e}")
+
+    # Movement status
+    def on_movement_status(self, data):
+        if "status" and "command" and "descriptionId" in data:
+            robot_status = str(data["status"])
+            values = {"robot_status": robot_status, "previous_status": robot_status,
+                      "robot_command": str(data["command"]),
+                      "status_description_id": str(data["descriptionId"])}
+            if robot_status == "abort" and self.previous_status == "reposing":
+                values["interaction_positioning"] = True
+            self.state.update(**values)
+
+    # Robot position
+    def on_position(self, data):
+        if "location" in data:
+            self.location_mqtt = data["location"]
+        if "room" in data:
+            self.room_mqtt = data["room"]
+
+    # Pause button response
+    def on_button(self, data):
+        if "status" in data:
+            self.response = str(data["status"])
+
+    # Robot speaking
+    def on_speak(self, data):
+        if "status" in data:
+            self.speaking = str(data["status"])
+
+    # User’s answer
+    def on_answer(self, data):
+        if "texto" in data:
+            self.response = str(data["text"].strip("[]"))
+
+    # User interaction with robot
+    def on_interaction(self, payload):
+        self.usage_timer = time()
+
+    # End video call
+    def on_videoconf(self, data):
+        if "status" in data:
+            if str(data["status"]) == "ended":
+                self.end_call = True
+
+    # Robot menu
+    def on_menu(self, data):
+        if "menu" in data:
+            self.menu = str(data["menu"])
+
+    # Fall detection result
+    def on_person_found_state(self, data):
+        if not self.fall_result_received:
+            if "fallen" and "not_fallen" in data:
+                if int(data["fallen"]) > 0:
+                    self.person_state = "fallen"
+                    self.fall_result_received = True
+                elif int(data["not_fallen"]) > 0:
+                    self.person_state = "not_fallen"
+                    self.fall_result_received = True
+                else:
+                    self.person_state = "nobody"   # cambiar
+                    self.fall_result_received = True
+
+
+# Scheduler of the ticks of a BT. After a tick, the next one happens when a
+# field of the robot state that the running nodes wait for changes (their
+# state_keys(), any field for nodes without it), when the nearest deadline of
+# a running node is reached, or after Idle_tick_period seconds, but never
+# faster than Max_tick_rate ticks per second (Execution section of config.txt)
+class TickScheduler():
+    STOP_CHECK_PERIOD = 0.1
+
+    def __init__(self, mqtt, max_tick_rate=None, idle_tick_period=None):
+        execution_config = config.get('Execution', {})
+        if max_tick_rate is None:
+            max_tick_rate = float(execution_config.get('Max_tick_rate', 20))
+        if idle_tick_period is None:
+            idle_tick_period = float(execution_config.get('Idle_tick_period', 1))
+        self.mqtt = mqtt
+        self.min_period = 1 / max_tick_rate
+        self.idle_period = idle_tick_period
+        self.last_tick = 0
+        self.seen_version = 0
+        self.tick_thread = None
+
+    # The version is read before the tick, so that a robot message processed
+    # during the tick wakes the next one. The state changes made by the nodes
+    # of the tree (in this thread) do not wake it
+    def tick(self, tree):
+        self.last_tick = time()
+        self.seen_version = self.mqtt.state.version()
+        self.tick_thread = threading.get_ident()
+        tree.tick_once()
+
+    # Nearest time at which a running node times out (None if there is none)
+    def next_deadline(self, tree):
+        deadlines = [node.deadline() for node in tree.iterate()
+                     if node.status == Status.RUNNING and hasattr(node, "deadline")]
+        deadlines = [d for d in deadlines if d is not None]
+        return min(deadlines) if deadlines else None
+
+    # Fields of the robot state the running leaves wait for (None for any)
+    def watched_keys(self, tree):
+        keys = set()
+        for node in tree.iterate():
+            if node.status != Status.RUNNING or node.children:
+                continue
+            node_keys = node.state_keys() if hasattr(node, "state_keys") else None
+            if node_keys is None:
+                return None
+            keys.update(node_keys)
+        return keys
+
+    # Waits until the next tick. If should_stop is given, it is checked at least
+    # every STOP_CHECK_PERIOD seconds, and True is returned when it asks to stop
+    def wait(self, tree, should_stop=None):
+        wake_time = self.last_tick + self.idle_period
+        deadline = self.next_deadline(tree)
+        if deadline is not None:
+            wake_time = min(wake_time, deadline)
+        earliest = self.last_tick + self.min_period
+        keys = self.watched_keys(tree)
+
+        while True:
+            if should_stop is not None and should_stop():
+                return True
+            now = time()
+            changed = self.mqtt.state.changed_since(self.seen_version, keys, self.tick_thread)
+            if now >= max(wake_time, earliest) or (now >= earliest and changed):
+                return False
+            if now < earliest:
+                timeout = earliest - now
+            else:
+                timeout = wake_time - now
+            if should_stop is not None:
+                timeout = min(timeout, self.STOP_CHECK_PERIOD)
+            if now < earliest:
+                sleep(timeout)
+            else:
+                self.mqtt.state.wait_for_change(self.seen_version, timeout, keys, self.tick_thread)
+
+
+# The fields of the robot state are also attributes of receiveTopics
+# (mqtt.response, mqtt.person_state...), stored in its RobotState
+def state_property(key):
+    def get(self):
+        return getattr(self.state, key)
+
+    def set(self, value):
+        self.state.set(key, value)
+    return property(get, set)
+
+def add_state_properties(cls):
+    for key in RobotState.FIELDS:
+        setattr(cls, key, state_property(key))
+
+add_state_properties(receiveTopics)
 
 
 # Function to store if an error occurs
@@ -232,6 +434,7 @@ class MoveToDestination(Behaviour):
             self.timer = 0
             self.obstacle_timer = 0
             self.pause_timer = 0
+            self.paused = False
             self.robot_moving = False
             self.max_move_time = int(config['Waits_and_Times']['Time_to_reach_destination'])
             self.max_pause_time = int(config['Waits_and_Times']['Max_pause_time'])
@@ -241,6 +444,25 @@ class MoveToDestination(Behaviour):
 
     def update(self):
         try:
+            # Pause state: check the user's response (yes/no/finish) once per tick
+            if self.paused:
+                response = self.mqtt.response
+                if response == "yes" or response == "yeah":
+                    self.mqtt.state.compare_and_set("response", response, "")
+                    self.paused = False
+                    return Status.SUCCESS
+                elif response == "no":
+                    self.robot_moving = False
+                    self.mqtt.status_description_id = "0"
+                    self.mqtt.state.compare_and_set("response", response, "")
+                    self.paused = False
+                    return Status.RUNNING
+                elif response == "end" or time() - self.pause_timer > self.max_pause_time:
+                    self.mqtt.state.compare_and_set("response", response, "")
+                    self.paused = False
+                    return Status.FAILURE
+                return Status.RUNNING
+
             # Send MQTT order to move the robot to the destination
             if not self.robot_moving:
                 if self.destination is None:
@@ -279,19 +501,9 @@ class MoveToDestination(Behaviour):
                 topic = self.topic_header + "/input/system/click_button"
                 self.mqtt.publish_mqtt(topic, msg)
                 self.pause_timer = time()
-                # Manage possible responses
-                while time() - self.pause_timer < self.max_pause_time:
-                    if self.mqtt.response == "yes" or self.mqtt.response == "yeah":
-                        self.mqtt.response = ""
-                        return Status.SUCCESS
-                    elif self.mqtt.response == "no":
-                        self.robot_moving = False
-                        self.mqtt.status_description_id = "0"
-                        self.mqtt.response = ""
-                        return Status.RUNNING
-                    elif self.mqtt.response == "end" or time() - self.pause_timer > self.max_pause_time:
-                        self.mqtt.response = ""
-                        return Status.FAILURE
+                # The responses are managed in the next ticks
+                self.paused = True
+                return Status.RUNNING
             # If no obstacle detected, reset obstacle timer
             else:
                 if self.mqtt.robot_status == "obstacle detected":
@@ -304,6 +516,33 @@ class MoveToDestination(Behaviour):
             store_failure(self.__class__.__name__, self.name, e, self.mqtt)
             return Status.FAILURE
 
+    # Time at which the pause, the movement or the obstacle wait times out
+    def deadline(self):
+        if self.paused:
+            return self.pause_timer + self.max_pause_time
+        if not self.robot_moving:
+            return None
+        return min(self.timer + self.max_move_time, self.obstacle_timer + 10)
+
+    # Robot state fields that the movement or the pause waits for
+    def state_keys(self):
+        if self.paused:
+            return ("response",)
+        return ("robot_status", "status_description_id", "interaction_positioning")
+
+    # If the tree is stopped while moving (preempted plan), stop the robot, so
+    # that it does not keep going to the old destination
+    def terminate(self, new_status):
+        try:
+            if new_status == Status.INVALID and self.status == Status.RUNNING and self.robot_moving:
+                topic = self.topic_header + "/input/movement/stop"
+                self.mqtt.publish_mqtt(topic, json.dumps({}))
+                logging.info(f"{filename} - MoveToDestination interrupted")
+        except Exception as e:
+            logging.error(f"{filename} - Error in MoveToDestination terminate: {e}")
+        self.robot_moving = False
+        self.paused = False
+
 
 # Node that plays a message
 class SpeakMessage(Behaviour):
@@ -348,24 +587,42 @@ class SpeakMessage(Behaviour):
             self.speak_ended = False
             return Status.FAILURE
 
-# Node to check whether a condition holds
+    # Time at which the robot is considered not to have spoken
+    def deadline(self):
+        if not self.speak_ended:
+            return None
+        return self.speak_timer + self.max_speak_time
+
+    def state_keys(self):
+        return ("speaking",)
+
+# Node to check whether a condition holds.
+# With a timeout (seconds), it waits until the variable takes the value: it
+# returns RUNNING and is checked again when a robot message is processed,
+# and FAILURE if the timeout expires
 class Condition(Behaviour):
-    def __init__(self, name, variable, value, mqtt):
+    def __init__(self, name, variable, value, mqtt, timeout=None):
         try:
             super(Condition, self).__init__(name)
             self.mqtt = mqtt
             self.variable = str(variable)
             self.variable_name = self.variable
             self.expected = value
+            self.timeout = timeout
+            self.wait_timer = 0
         except Exception as e:
             logging.error(f"{filename} - Error in Condition init: {e}")
 
+    def initialise(self):
+        self.wait_timer = time()
+
     def update(self):
         try:
-            sleep(1)
             current_value = getattr(self.mqtt, self.variable)
             if current_value == self.expected:
                 return Status.SUCCESS
+            elif self.timeout is not None and time() - self.wait_timer < self.timeout:
+                return Status.RUNNING
             else:
                 return Status.FAILURE
         except Exception as e:
@@ -373,6 +630,18 @@ class Condition(Behaviour):
             store_failure(self.__class__.__name__, self.name, e, self.mqtt)
             return Status.FAILURE
 
+    # Time at which the wait for the value times out
+    def deadline(self):
+        if self.timeout is None:
+            return None
+        return self.wait_timer + self.timeout
+
+    # The variable, if it is a field of the robot state (any field otherwise)
+    def state_keys(self):
+        if self.variable in RobotState.FIELDS:
+            return (self.variable,)
+        return None
+
  
 # Node that plays a final reminder and checks the BT result
 class Reminder(Behaviour):
@@ -456,12 +725,12 @@ class AskQuestion(Behaviour):
         try:
             # Wait for the answer
             if time() - self.answer_timer < self.wait_answer_secs:
-                if self.mqtt.response:
-                    self.mqtt.answer = self.mqtt.response
-                    self.mqtt.response = ""
+                # The response is read and cleared at once, so it is not lost if it arrives meanwhile
+                response = self.mqtt.state.swap("response", "")
+                if response:
+                    self.mqtt.answer = response
                     return Status.SUCCESS
                 else:
-                    self.mqtt.response = ""
                     return Status.RUNNING
             else:
                 self.mqtt.answer = "no answer"
@@ -471,6 +740,13 @@ class AskQuestion(Behaviour):
             logging.error(f"{filename} - Error in AskQuestion update: {e}")
             store_failure(self.__class__.__name__, self.name, e, self.mqtt)
             return Status.FAILURE
+
+    # Time at which the question is left without answer
+    def deadline(self):
+        return self.answer_timer + self.wait_answer_secs
+
+    def state_keys(self):
+        return ("response",)
         
         
 # Node to perform a video call
@@ -516,6 +792,24 @@ class Videoconference(Behaviour):
             logging.error(f"{filename} - Error in Videoconference update: {e}")
             store_failure(self.__class__.__name__, self.name, e, self.mqtt)
             return Status.FAILURE
+
+    # Time at which the call is stopped
+    def deadline(self):
+        return self.call_timer + self.max_call_time
+
+    def state_keys(self):
+        return ("end_call",)
+
+    # If the tree is stopped during the call (preempted plan), hang up
+    def terminate(self, new_status):
+        try:
+            if new_status == Status.INVALID and self.status == Status.RUNNING:
+                msg_call = {'user': self.contact}
+                msg_call = json.dumps(msg_call)
+                topic = self.topic_header + "/input/videoconf/stop"
+                self.mqtt.publish_mqtt(topic, msg_call)
+        except Exception as e:
+            logging.error(f"{filename} - Error in Videoconference terminate: {e}")
         
         
 # Node to send an alert
@@ -614,4 +908,22 @@ class DetectFall(Behaviour):
         except Exception as e:
             logging.error(f"{filename} - Error in DetectFall update: {e}")
             store_failure(self.__class__.__name__, self.name, e, self.mqtt)
-            return Status.FAILURE
\ No newline at end of file
+            return Status.FAILURE
+
+    # Time at which the detection ends without result
+    def deadline(self):
+        return self.timer + 20
+
+    def state_keys(self):
+        return ("fall_result_received", "person_state")
+
+    # If the tree is stopped during the detection (preempted plan), close the camera
+    def terminate(self, new_status):
+        try:
+            if new_status == Status.INVALID and self.status == Status.RUNNING:
+                topic_stop_cam = self.topic_header + "/input/video/image_stop"
+                payload = {"frequency": 0, "angle": self.photo_angle, "resolutionX": 600, "resolutionY": 600}
+                payload = json.dumps(payload)
+                self.mqtt.publish_mqtt(topic_stop_cam, payload)
+        except Exception as e:
+            logging.error(f"{filename} - Error in DetectFall terminate: {e}")
\ No newline at end of file
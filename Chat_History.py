@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+@author: smerino
+"""
+
+import threading
+from BT_Cache import LRUCache
+from Config import config
+
+# Tokens added by the API to every message (role, separators)
+MESSAGE_TOKENS = 4
+# Length of the excerpt of an evicted request kept in the summary
+SUMMARY_EXCERPT = 120
+
+
+# Approximate number of tokens of a text (about 4 characters per token in
+# English and code), enough to keep the context under a budget
+def count_tokens(text):
+    return len(text) // 4 + 1
+
+
+def message_tokens(message):
+    return count_tokens(message["content"]) + MESSAGE_TOKENS
+
+
+# -------------------------------------------------------
+# ChatHistory
+# -------------------------------------------------------
+# Conversation of one user with the LLM. When the turns
+# exceed the token budget, the oldest ones are evicted and
+# a one-line excerpt of each evicted request is kept in a
+# summary, which is itself limited to summary_tokens. The
+# last message is always kept.
+class ChatHistory():
+    def __init__(self, max_tokens, summary_tokens):
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.turns = []
+        self.summary = []
+        self.tokens = 0
+
+    def add(self, role, content):
+        message = {"role": role, "content": content}
+        self.turns.append(message)
+        self.tokens += message_tokens(message)
+        self.trim()
+
+    def summary_message(self):
+        if not self.summary:
+            return None
+        return {"role": "system",
+                "content": "Earlier requests of this conversation:\n" + "\n".join(self.summary)}
+
+    def messages(self):
+        summary = self.summary_message()
+        return ([summary] if summary else []) + list(self.turns)
+
+    # Evicts the oldest turns until the history fits in the budget
+    def trim(self):
+        while self.tokens + self.summary_size() > self.max_tokens and len(self.turns) > 1:
+            message = self.turns.pop(0)
+            self.tokens -= message_tokens(message)
+            if message["role"] == "user":
+                self.summarize(message["content"])
+
+    def summarize(self, content):
+        lines = content.strip().splitlines()
+        excerpt = lines[0].strip() if lines else ""
+        if len(excerpt) > SUMMARY_EXCERPT:
+            excerpt = excerpt[:SUMMARY_EXCERPT] + "..."
+        self.summary.append(f"- {excerpt}")
+        while len(self.summary) > 1 and self.summary_size() > self.summary_tokens:
+            self.summary.pop(0)
+
+    def summary_size(self):
+        summary = self.summary_message()
+        return message_tokens(summary) if summary else 0
+
+
+# -------------------------------------------------------
+# HistoryManager
+# -------------------------------------------------------
+# Histories of the conversations with the LLM, one per
+# session (user). The system prompt is pinned at the start
+# of every history, so that the requests share the same
+# prefix, and counts against the token budget. Histories
+# are cleared when a new version of the prompt is set.
+# The least recently used sessions are dropped when there
+# are more than max_sessions. Budgets are read from the LLM
+# section of config.txt (History_tokens, History_sessions).
+# All methods are thread safe, as the requests are handled
+# in worker threads.
+class HistoryManager():
+    def __init__(self, system_prompt, max_tokens=None, max_sessions=None, summary_tokens=200):
+        llm_config = config.get('LLM', {})
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens if max_tokens is not None else int(llm_config.get('History_tokens', 8000))
+        max_sessions = max_sessions if max_sessions is not None else int(llm_config.get('History_sessions', 16))
+        self.summary_tokens = summary_tokens
+        self.sessions = LRUCache(max_sessions)
+        self.lock = threading.Lock()
+
+    def system_message(self):
+        return {"role": "system", "content": self.system_prompt}
+
+    def set_system_prompt(self, system_prompt):
+        with self.lock:
+            if system_prompt != self.system_prompt:
+                self.system_prompt = system_prompt
+                self.sessions.clear()
+
+    # Adds a message to the history of the session and returns the messages
+    # to send: the system prompt followed by the history
+    def add(self, session, role, content):
+        with self.lock:
+            history = self.sessions.get(session)
+            if history is None:
+                budget = max(self.max_tokens - message_tokens(self.system_message()), 0)
+                history = ChatHistory(budget, self.summary_tokens)
+                self.sessions.put(session, history)
+            history.add(role, content)
+            return [self.system_message()] + history.messages()
+
+    # True if the session has messages besides the system prompt
+    def has_history(self, session):
+        with self.lock:
+            return self.sessions.get(session) is not None
+
+    def messages(self, session):
+        with self.lock:
+            history = self.sessions.get(session)
+            return [self.system_message()] + (history.messages() if history else [])
+
+    # Removes the history of a session, or all of them if session is None
+    def clear(self, session=None):
+        with self.lock:
+            if session is None:
+                self.sessions.clear()
+            else:
+                self.sessions.pop(session)
+
+    def __len__(self):
+        return len(self.sessions)
@@ -21,6 +21,7 @@ def on_message(client, userdata, msg):
     correction = message.get("correction")
     user = message.get("user")
     text = message.get("response")
+    request_id = message.get("id")
     
     # Tries to extract the code
     match_python = re.search(r"python\n(.*?)```", text, re.DOTALL)
@@ -32,13 +33,13 @@ def on_message(client, userdata, msg):
         text = match_python.group(1) 
         print("Code:\n",text)
         # Publish the response to BT_Planner module
-        payload = json.dumps({"correction":correction, "user": user, "response": text})
+        payload = json.dumps({"correction":correction, "user": user, "response": text, "id": request_id})
         
     elif match_def:   
         topic = "BT_Tester/input" 
         print("Code:\n",text)
         # Publish the response to BT_Planner module
-        payload = json.dumps({"correction":correction, "user": user, "response": text})
+        payload = json.dumps({"correction":correction, "user": user, "response": text, "id": request_id})
     
     # Otherwise, the robots asks the user for clarification
     else:
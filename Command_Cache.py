@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+@author: smerino
+"""
+
+import re
+import difflib
+import hashlib
+from time import time
+from BT_Cache import PersistentLRUCache
+
+# Words that do not change the meaning of a command
+FILLER_WORDS = {"temi", "please", "hey", "ok", "okay"}
+
+# Lines of the BT generation prompt that list the destinations and contacts
+VOCABULARY_LINE = re.compile(r"^\s*-\s*(?:Destinations|Contacts):(.*)$", re.MULTILINE)
+
+
+# Known word closest to a (possibly mistranscribed) word and its similarity
+# (None, 0 if there is none over the cutoff). Short words must match exactly
+def close_word(word, vocabulary, cutoff):
+    if len(word) < 4:
+        return (word, 1) if word in vocabulary else (None, 0)
+    best, best_ratio = None, 0
+    for known in vocabulary:
+        ratio = difflib.SequenceMatcher(None, word, known).ratio()
+        if ratio >= cutoff and ratio > best_ratio:
+            best, best_ratio = known, ratio
+    return best, best_ratio
+
+
+# Destinations and contacts listed in the BT generation prompt, lower case
+# and without spaces, as normalize_command joins the words of a name
+# ("mesa sergio" -> "mesasergio")
+def prompt_vocabulary(prompt_text):
+    vocabulary = []
+    for line in VOCABULARY_LINE.findall(prompt_text):
+        for entry in line.split(","):
+            word = "".join(entry.lower().split())
+            if word and word not in vocabulary:
+                vocabulary.append(word)
+    return vocabulary
+
+
+# -------------------------------------------------------
+# normalize_command
+# -------------------------------------------------------
+# Normalizes a voice command so that repeated orders get
+# the same key: lower case, no punctuation or filler words,
+# and the words that resemble a known destination or contact
+# (vocabulary) replaced by it, joining two words if they
+# match at least as well together as the second one alone
+# ("mesa sergio" -> "mesasergio", "ubi 1" -> "ubi1", but
+# "to mesasergio" is kept).
+def normalize_command(text, vocabulary=()):
+    vocabulary = [word.lower() for word in vocabulary]
+    words = [w for w in re.sub(r"[^\w\s]", " ", text.lower()).split() if w not in FILLER_WORDS]
+    normalized = []
+    i = 0
+    while i < len(words):
+        if i + 1 < len(words):
+            joined, ratio = close_word(words[i] + words[i + 1], vocabulary, 0.9)
+            if joined is not None and ratio >= close_word(words[i + 1], vocabulary, 0.8)[1]:
+                normalized.append(joined)
+                i += 2
+                continue
+        normalized.append(close_word(words[i], vocabulary, 0.8)[0] or words[i])
+        i += 1
+    return " ".join(normalized)
+
+
+# Fingerprint of the texts the generated BTs depend on (prompt, available actions)
+def fingerprint(*texts):
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+# -------------------------------------------------------
+# CommandCache
+# -------------------------------------------------------
+# Persistent cache of normalized command -> validated
+# create_behavior_tree code. Entries expire after ttl
+# seconds and the least recently used ones are evicted.
+# Keys include the fingerprint of the prompt, and the
+# cache is cleared when it is created with, or set to, a
+# different one, as the cached trees may no longer be valid.
+class CommandCache():
+    def __init__(self, path, prompt_fingerprint, max_size=128, ttl=7 * 24 * 3600):
+        self.entries = PersistentLRUCache(path, max_size)
+        self.ttl = ttl
+        self.set_fingerprint(prompt_fingerprint)
+
+    def set_fingerprint(self, prompt_fingerprint):
+        self.prompt_fingerprint = prompt_fingerprint
+        if any(not key.startswith(prompt_fingerprint + "|") for key in self.entries.keys()):
+            self.entries.clear()
+
+    def key(self, command):
+        return f"{self.prompt_fingerprint}|{command}"
+
+    # Cached code of a normalized command (None if missing or expired)
+    def get(self, command):
+        entry = self.entries.get(self.key(command))
+        if entry is None:
+            return None
+        if time() - entry["time"] > self.ttl:
+            self.entries.pop(self.key(command))
+            return None
+        return entry["code"]
+
+    def put(self, command, code):
+        self.entries.put(self.key(command), {"code": code, "time": time()})
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+@author: smerino
+"""
+
+import logging
+
+# Configuration of the modules, shared without importing the BT nodes
+CONFIG_FILE = 'config.txt'
+
+# Errors are logged without configuring the root logger, so that the modules
+# importing this one can still send their log to log.txt
+logger = logging.getLogger(__name__)
+
+
+# Function to read configuration data
+def read_config(file):
+    try:
+        config = {}
+        with open(file, 'r', encoding='utf-8') as f:
+            current_section = None
+            for line in f:
+                line = line.strip()
+                if line:
+                    if ':' in line:
+                        key, value = line.split(':', 1)
+                        key = key.strip()
+                        value = value.strip()
+                        if current_section:
+                            config[current_section][key] = value
+                        else:
+                            config[key] = value
+                    else:
+                        current_section = line
+                        config[current_section] = {}
+        return config
+    except Exception as e:
+        logger.error(f"Error reading config: {e}")
+
+
+# Extract information from config file
+config = read_config(CONFIG_FILE)
@@ -4,13 +4,12 @@
 """
 
 import paho.mqtt.client as mqtt
-import requests
 import json
 import re
-
-# Configure OpenAI API
-OPENAI_API_KEY = "your_API_key"
-CHATGPT_URL = "https://api.openai.com/v1/chat/completions"
+import os
+from LLM_Client import LLMClient
+from Chat_History import HistoryManager
+from Prompt_Registry import PromptRegistry, FAILURE_INTERPRETER_PROMPT
 
 # Configure MQTT broker
 broker = "your_broker"
@@ -22,207 +21,108 @@ TOPIC_IN = "Failure_Interpreter/input"
 TOPIC_OUT = "chatgpt/output"
 
 finished_plan_topic = "plan/finished"
-initial_message = True
-historic = []
 corrections = 0
 
-# Sends the message to ChatGPT and returns the response
-def send_to_chatgpt(message): 
-    global initial_message
-    global historic
-    global corrections
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    default_prompt = """
-Objective:  
-You are a Python py_trees Behavior Tree (BT) fixer for a social robot named Temi, which assists an elderly user.  
-You are given the following input:  
-- A description of the error or unexpected behavior observed during execution.
-- The current (possibly faulty) behavior tree full code.  
-
-Your task is to analyze, correct, and regenerate a fully functioning create_behavior_tree() function, strictly following all structural and semantic rules provided below.
-
-Fix Strategy:
-1. Understand the failure description and determine what is failing (logical issue, structure violation, unsupported action, etc.).
-2. Analyze the BT code and identify where the issue occurs.
-3. Regenerate a corrected create_behavior_tree() function that:
-   - Resolves the problem.
-   - Adheres to all defined behavior, naming, and structural rules.
-   - First declares all nodes and then, in a separate section, adds all children.
-4. Include error handling with try-except, and use:
-   logging.error(f"Error in create_behavior_tree: {e}")
-
-Available Actions (Nodes):
-1. Move: MoveToDestination(name, destination, mqtt)
-   - Destinations: mesa sergio, ubisalon, ubi1, ubi2
-   - SUCCESS when the robot reaches the target location
-   - Fails if invalid location requested or can't reach the target location
-2. Speak: SpeakMessage(name, message, mqtt)
-   - Outputs the message audibly
-   - SUCCESS when the robot ends saying the message
-3. Ask: AskQuestion(name, question, mqtt)
-   - Asks the user a question and stores reply in 'answer'
-   - SUCCESS when the robot ends asking the question and receives an answer
-4. Check Condition: Condition(name, variable, value, mqtt)
-   - Checks MQTT variables (person_state, answer)
-   - SUCCESS when the checked variable contains the desired value
-5. Call: Videoconference(name, contact, mqtt)
-   - Contacts: Sergio, David, Anna, my brother, emergency
-   - SUCCESS when the videoconference ends successfully
-   - Fails if invalid contact requested
-6. Alert: Alert(name, message, contact, mqtt)
-   - Sends a notification to a contact
-   - Contacts: Sergio, David, Anna, my brother, emergency
-   - SUCCESS if the message is sent successfully
-   - Fails if invalid contact requested
-7. Detect Fall: DetectFall(name, mqtt)
-   - Used to find people and check if they are fallen or not fallen
-   - SUCCESS when the detection ends
-8. Final Check: Reminder(name, mqtt)
-   - Must always be the last node (checks BT success)
-   - SUCCESS when the execution of the whole BT has been successful
-
-Rules for create_behavior_tree():
-1. Structure:
-   - Root: Sequence(name="Root", memory=True)
-     - Child 1: FailureIsSuccess (wrapping main logic in a Sequence/Selector if multiple actions).
-     - Child 2: Reminder(name="Reminder", mqtt=mqtt) (always last).
-2. Error Handling:
-   - All code must be in try-except block
-   - Log errors using: logging.error(f"{filename} - Error in create_behavior_tree: {e}")
-3. MQTT Variables:
-   - person_state: "fallen", "not_fallen", or None.
-   - answer: User's response to AskQuestion.
-4. Node declarations and child assignments:
-   - First, declare all nodes (including composite nodes like Sequence, Selector, and leaf nodes like Action, Condition).
-   - Then, in a separate section, add all children.
-   
-Example Output Format:
-Command:
-"Temi, go to the kitchen and say 'Hello, my name is Temi'"
-
-Generated create_behavior_tree():
-def create_behavior_tree(mqtt):
-    try:
-        # Behavior Tree Nodes declarations
-        root = py_trees.composites.Sequence(name="Root", memory=True)
-        sequence1 = py_trees.composites.Sequence(name="sequence1", memory=True)
-        move_destination = MoveToDestination(name="GoToKitchen", destination="kitchen", mqtt=mqtt)
-        speak_message = SpeakMessage(name="SayHello", message="Hello, my name is Temi", mqtt=mqtt)
-        reminder = Reminder(name="Reminder", mqtt=mqtt)
-        
-        # Child assignments
-        sequence1.add_children([move_destination, speak_message])
-        failure_is_success = py_trees.decorators.FailureIsSuccess(name = "failure_is_success", child = sequence1)
-    
-        # Add branches to root
-        root.add_children([failure_is_success, reminder])
-    
-        return root
-    except Exception as e:
-        logging.error(f"Error in create_behavior_tree: {e}")
-
-Critical Rules:
-1. If command is unclear, the generated output should ONLY inform the user about why the command is unclear and ask them to try again, and don’t generate any code.
-2. For unsupported actions, the generated output should ONLY inform the user about why the robot can't do that, and don’t generate any code.
-3. The assistant should ONLY generate the create_behavior_tree() function.
-4. Root always has only two children, the failure is success decorator and the reminder node.
-5. Use Condition nodes to check variables when needed (after asking a question and using FallDetection node.
-6. SpeakMessage outputs should be clear and helpful for elderly users
-7. Sequence and Selector nodes always have memory = True
-8. To implement if / else if / else logic, use a Selector (memory=True) with child Sequences that begin with Condition nodes and include the corresponding actions; the Selector returns SUCCESS on the first valid branch.
-9. Your output must ONLY be the corrected create_behavior_tree() function. Do not include explanations, comments, or any other text.
-10. Input messages are captured from voice, so if a requested location, action or contact resembles to an available one, select it.
-11. If error is "tuple index out of range", make sure that all nodes are defined before starting to add them
-
-Input:
+# Shared LLM connection, with worker threads for the requests
+llm = LLMClient()
 
-"""
+# System prompt of the BT correction, reloaded when its file changes
+prompts = PromptRegistry()
 
-    
-    if initial_message:
-        historic.append({"role": "system", "content": default_prompt})
-        initial_message = False
-        
-    historic.append({"role": "user", "content": message})
+# Correction requests of each user, within the token budget. A new version of
+# the prompt clears them
+histories = HistoryManager(prompts.get(FAILURE_INTERPRETER_PROMPT).text)
+prompts.subscribe(FAILURE_INTERPRETER_PROMPT, lambda prompt: histories.set_system_prompt(prompt.text))
+
+# Sends the message to ChatGPT, with the previous requests of the user, and
+# returns the response
+def send_to_chatgpt(message, user=None): 
+    global corrections
+
+    prompt = prompts.get(FAILURE_INTERPRETER_PROMPT)
+    messages = histories.add(user, "user", message)
     corrections =+ 1
     print(f"Corrections: {corrections}")
     if corrections < 5:
-        data = {
-            "model": "gpt-4o",
-            "messages": historic,
-            "max_tokens": 500
-        }
-        
         try:
-            response = requests.post(CHATGPT_URL, headers=headers, json=data)
-            reply = response.json()["choices"][0]["message"]["content"]
+            reply = llm.complete(messages, model="gpt-4o", max_tokens=500, cache_key=prompt.fingerprint)
             return reply.strip()
         except Exception as e:
             return f"API Error: {e}"
     else:
         print("Max number corrections")
 
+# Asks ChatGPT to correct a failed BT and publishes the response (worker thread)
+def process_failure(client, message):
+    filename = message.get("filename")
+    error = message.get("error")
+    user = message.get("user")
+    request_id = message.get("id")
+
+    # BT_Executor sends the code of the plan, BT_Tester a file
+    python_code = message.get("code")
+    if python_code is None:
+        with open(filename, "r", encoding="utf-8") as file:
+            python_code = file.read()
+
+    # Failed tests are stored in a scratch file per request
+    tester_fail = os.path.basename(filename).startswith("BT_Tester_fail")
+    if tester_fail:
+        os.remove(filename)
+
+    if not tester_fail:
+        response = send_to_chatgpt(error + python_code, user)
+
+    else:
+        if error == "-":     
+
+            # Finds last error in the log file
+            def find_last_error(log_file):
+                last_error = None
+                with open(log_file, "r", encoding="utf-8") as file:
+                    for line in file:
+                        match = re.search(r"ERROR\s*-\s*(.*)", line)  
+                        if match:
+                            last_error = match.group(1).strip()
+                return last_error
+
+            log_file = "log.txt"  
+            last_error = find_last_error(log_file)
+            print("Last error:", last_error)
+
+            if last_error != None:
+                # Sends to ChatGPT the found error
+                response = send_to_chatgpt(last_error + python_code, user)
+            else:
+                # If it cannot find the error, sends to ChatGPT a general error message
+                response = send_to_chatgpt("""The execution of the given code went wrong. Please fix it
+                                               """ + python_code, user)               
+        else:
+            response = send_to_chatgpt(error + python_code, user)
+
+
+    print(f"ChatGPT response: {response}")
+
+    if corrections < 5:
+        # Publish the response to Clarifier module
+        response = json.dumps({"correction":"True","user": user, "response": response, "id": request_id})
+        client.publish(TOPIC_OUT, response)
+
 # Handles messages received on chatgpt/input
 def on_message(client, userdata, msg): 
     global TOPIC_IN
     global finished_plan_topic
-    global initial_message
-    global historic
     global corrections
     if msg.topic == TOPIC_IN:
         message = json.loads(msg.payload.decode())  # Decode JSON
-        filename = message.get("filename")
-        error = message.get("error")
-        user = message.get("user")
-        
-        with open(filename, "r", encoding="utf-8") as file:
-            python_code = file.read()
-            
-        if filename != "BT_Tester_fail.py":
-            response = send_to_chatgpt(error + python_code)
-            
-        else:
-            if error == "-":     
-                
-                # Finds last error in the log file
-                def find_last_error(log_file):
-                    last_error = None
-                    with open(log_file, "r", encoding="utf-8") as file:
-                        for line in file:
-                            match = re.search(r"ERROR\s*-\s*(.*)", line)  
-                            if match:
-                                last_error = match.group(1).strip()
-                    return last_error
-            
-                log_file = "log.txt"  
-                last_error = find_last_error(log_file)
-                print("Last error:", last_error)
-                
-                if last_error != None:
-                    # Sends to ChatGPT the found error
-                    response = send_to_chatgpt(last_error + python_code)
-                else:
-                    # If it cannot find the error, sends to ChatGPT a general error message
-                    response = send_to_chatgpt("""The execution of the given code went wrong. Please fix it
-                                                   """ + python_code)               
-            else:
-                response = send_to_chatgpt(error + python_code)
-                
-    
-        print(f"ChatGPT response: {response}")
         
-        if corrections < 5:
-            # Publish the response to Clarifier module
-            response = json.dumps({"correction":"True","user": user, "response": response})
-            client.publish(TOPIC_OUT, response)
+        # The failure is handled in a worker thread, so that MQTT is not blocked
+        llm.submit(process_failure, client, message)
         
     if msg.topic == finished_plan_topic:
-        initial_message = True
-        historic = []
+        # The conversation of the user ends with the plan
+        message = json.loads(msg.payload.decode())
+        histories.clear(message.get("user"))
 
 # Configure MQTT client
 client = mqtt.Client()
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+@author: smerino
+"""
+
+import logging
+import json
+from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from Config import config
+
+# Configure OpenAI API
+OPENAI_API_KEY = "your_API_key"
+CHATGPT_URL = "https://api.openai.com/v1/chat/completions"
+
+# HTTP status codes worth retrying
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# Start of the code block of a reply, as Clarifier extracts it
+CODE_START = "python\n"
+CODE_END = "```"
+
+
+class LLMError(Exception):
+    pass
+
+
+# -------------------------------------------------------
+# LLMClient
+# -------------------------------------------------------
+# Client of the chat completions API shared by the modules
+# that talk to the LLM. It keeps a pool of keep-alive
+# connections, applies a timeout to every request and
+# retries connection errors, timeouts and 429/5xx answers
+# with exponential backoff. Requests can be made from a
+# pool of worker threads (complete_async), so that MQTT
+# callbacks are not blocked while the LLM answers.
+# The URL, timeout, retries and workers are read from the
+# LLM section of config.txt; URL can point to a local
+# stand-in server for testing.
+class LLMClient():
+    def __init__(self, url=None, api_key=OPENAI_API_KEY, timeout=None, retries=None, backoff=1, workers=None):
+        llm_config = config.get('LLM', {})
+        self.url = url or llm_config.get('URL', CHATGPT_URL)
+        self.api_key = api_key
+        self.timeout = timeout if timeout is not None else float(llm_config.get('Timeout', 60))
+        self.retries = retries if retries is not None else int(llm_config.get('Retries', 3))
+        self.backoff = backoff
+        self.streaming = llm_config.get('Stream', 'False') == 'True'
+        workers = workers if workers is not None else int(llm_config.get('Workers', 4))
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm")
+
+    # Posts the request, retrying when it fails. Raises LLMError when it
+    # fails after the retries
+    def post(self, data, stream=False):
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(self.url, json=data, timeout=self.timeout, stream=stream)
+                if response.status_code in RETRY_STATUS:
+                    response.close()
+                    raise LLMError(f"HTTP {response.status_code}")
+                response.raise_for_status()
+                return response
+            except (requests.ConnectionError, requests.Timeout, LLMError) as e:
+                error = e
+                if attempt < self.retries:
+                    logging.info(f"LLM request failed ({e}), retrying")
+                    sleep(self.backoff * 2 ** attempt)
+            except Exception as e:
+                raise LLMError(e)
+        raise LLMError(error)
+
+    # Body of a request. cache_key (the fingerprint of the system prompt) is
+    # sent as prompt_cache_key, so that the requests that start with the same
+    # prompt are routed to the same prompt cache of the API
+    def request_data(self, messages, model, max_tokens, cache_key=None):
+        data = {"model": model, "messages": messages, "max_tokens": max_tokens}
+        if cache_key is not None:
+            data["prompt_cache_key"] = cache_key
+        return data
+
+    # Sends the messages and returns the content of the reply
+    def complete(self, messages, model="gpt-4o", max_tokens=1000, cache_key=None):
+        response = self.post(self.request_data(messages, model, max_tokens, cache_key))
+        try:
+            return response.json()["choices"][0]["message"]["content"]
+        except Exception as e:
+            raise LLMError(e)
+
+    # Sends the messages and yields the content of the reply as it is
+    # generated (server-sent events). Only the request is retried: an error
+    # in the middle of the stream raises LLMError
+    def stream(self, messages, model="gpt-4o", max_tokens=1000, cache_key=None):
+        data = self.request_data(messages, model, max_tokens, cache_key)
+        data["stream"] = True
+        response = self.post(data, stream=True)
+        try:
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                event = line[len("data:"):].strip()
+                if event == "[DONE]":
+                    break
+                delta = json.loads(event)["choices"][0].get("delta", {})
+                if delta.get("content"):
+                    yield delta["content"]
+        except (requests.RequestException, ValueError, KeyError, IndexError) as e:
+            raise LLMError(e)
+        finally:
+            response.close()
+
+    # Runs complete() in a worker thread and returns its Future
+    def complete_async(self, messages, model="gpt-4o", max_tokens=1000, cache_key=None):
+        return self.submit(self.complete, messages, model, max_tokens, cache_key)
+
+    # Runs a function in a worker thread and returns its Future. Exceptions
+    # are logged, as nobody may be waiting for the result
+    def submit(self, function, *args):
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(log_exception)
+        return future
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+# -------------------------------------------------------
+# CodeFenceParser
+# -------------------------------------------------------
+# Incremental parser of a streamed reply. It detects the
+# end of the python code block (the block Clarifier
+# extracts), so that the tree can be sent to validation
+# before the rest of the reply arrives. Each chunk is only
+# searched from where the previous search stopped.
+class CodeFenceParser():
+    def __init__(self):
+        self.text = ""
+        self.code_start = None
+        self.search_from = 0
+        self.code = None
+
+    # Adds a chunk of the reply. Returns the code the first time the closing
+    # fence is received, None otherwise
+    def feed(self, chunk):
+        self.text += chunk
+        if self.code is not None:
+            return None
+        if self.code_start is None:
+            index = self.text.find(CODE_START, max(0, self.search_from - len(CODE_START)))
+            self.search_from = len(self.text)
+            if index < 0:
+                return None
+            self.code_start = index + len(CODE_START)
+            self.search_from = self.code_start
+        index = self.text.find(CODE_END, max(self.code_start, self.search_from - len(CODE_END)))
+        self.search_from = len(self.text)
+        if index < 0:
+            return None
+        self.code = self.text[self.code_start:index]
+        return self.code
+
+
+def log_exception(future):
+    if not future.cancelled() and future.exception() is not None:
+        logging.error(f"Error in LLM request: {future.exception()}")
@@ -4,14 +4,17 @@
 """
 
 import paho.mqtt.client as mqtt
-import requests
 import json
 import subprocess
 import platform
-
-# Configure OpenAI API
-OPENAI_API_KEY = "your_API_key"
-CHATGPT_URL = "https://api.openai.com/v1/chat/completions"
+import uuid
+from LLM_Client import LLMClient, CodeFenceParser
+from Command_Cache import CommandCache, normalize_command, prompt_vocabulary, fingerprint
+from Chat_History import HistoryManager
+from Prompt_Registry import PromptRegistry, BT_GENERATION_PROMPT
+from BT_Cache import LRUCache
+from BT_Analyzer import ACTION_ARGUMENTS
+from Config import config
 
 # Configure MQTT broker
 broker = "your_broker"
@@ -21,9 +24,44 @@ password = "your_password"
 
 TOPIC_IN = "chatgpt/input"
 TOPIC_OUT = "chatgpt/output"
-initial_message = True
 finished_plan_topic = "plan/finished"
-historic = []
+
+# Shared LLM connection, with worker threads for the requests
+llm = LLMClient()
+
+# System prompt of the BT generation, reloaded when its file changes
+prompts = PromptRegistry()
+prompt = prompts.get(BT_GENERATION_PROMPT)
+
+# Conversation of each user with ChatGPT, within the token budget
+histories = HistoryManager(prompt.text)
+
+# Version of the prompt and the available actions the generated BTs depend on
+def cache_fingerprint(prompt):
+    return fingerprint(prompt.fingerprint, json.dumps(ACTION_ARGUMENTS))
+
+# Cache of validated BTs for repeated commands. Its key includes the
+# fingerprint of the prompt and the available actions, so it is invalidated
+# when they change. Only commands that start a conversation are cached, as an
+# answer to a clarification ("yes", "the kitchen") depends on the history.
+# Commands are normalized with the destinations and contacts of the prompt
+vocabulary = prompt_vocabulary(prompt.text)
+VALIDATED_TOPIC = "BT_Planner/input"
+llm_config = config.get('LLM', {})
+command_cache = CommandCache("Command_cache.json",
+                             cache_fingerprint(prompt),
+                             int(llm_config.get('Command_cache_size', 128)),
+                             float(llm_config.get('Command_cache_ttl_hours', 168)) * 3600)
+pending_commands = LRUCache(64)   # request id -> normalized command waiting for validation
+
+# A new version of the prompt clears the histories and the cached BTs
+def prompt_changed(prompt):
+    global vocabulary
+    histories.set_system_prompt(prompt.text)
+    command_cache.set_fingerprint(cache_fingerprint(prompt))
+    vocabulary = prompt_vocabulary(prompt.text)
+
+prompts.subscribe(BT_GENERATION_PROMPT, prompt_changed)
 
 #Execute Fall detection code
 if platform.system() == 'Windows':
@@ -33,152 +71,85 @@ elif platform.system() == 'Linux':
 else:
     pass
 
-# Sends the message to ChatGPT and returns the response
-def send_to_chatgpt(message):  
-    global initial_message
-    global historic
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    
-    default_prompt = """
-        Objective:
-You are a Python py_trees Behavior Tree (BT) generator for a social robot named Temi, which assists an elderly user. Given a natural-language command, construct a BT using predefined actions and strict structural rules.
-
-Generate only the create_behavior_tree() function that contains the logic and the nodes.
-
-Available Actions (Nodes):
-1. Move: MoveToDestination(name, destination, mqtt)
-   - Destinations: mesa sergio, ubisalon, ubi1, ubi2
-   - SUCCESS when the robot reaches the target location
-   - Fails if invalid location requested or can't reach the target location
-2. Speak: SpeakMessage(name, message, mqtt)
-   - Outputs the message audibly
-   - SUCCESS when the robot ends saying the messsage
-3. Ask: AskQuestion(name, question, mqtt)
-   - Asks the user a question and stores reply in 'answer'
-   - SUCCESS when the robot ends asking the question and receives an answer
-4. Check Condition: Condition(name, variable, value, mqtt)
-   - Checks MQTT variables (person_state, answer)
-   - SUCCESS when the checked variable contains the desired value
-5. Call: Videoconference(name, contact, mqtt)
-   - Contacts: Sergio, David, Anna, my brother, emergency
-   - SUCCESS when the videoconference ends successfully
-   - Fails if invalid contact requested
-6. Alert: Alert(name, message, contact, mqtt)
-   - Sends a notification to a contact
-   - Contacts: Sergio, David, Anna, my brother, emergency
-   - SUCCESS if the message is sent successfully
-   - Fails if invalid contact requested
-7. Detect Fall: DetectFall(name, mqtt)
-   - Used to find people and check if they are fallen or not fallen
-   - SUCCESS when the detection ends
-8. Final Check: Reminder(name, mqtt)
-   - Must always be the last node (checks BT success)
-   - SUCCESS when the execution of the whole BT has been successful
-
-Rules for create_behavior_tree():
-1. Structure:
-   - Root: Sequence(name="Root", memory=True)
-     - Child 1: FailureIsSuccess (wrapping main logic in a Sequence/Selector if multiple actions).
-     - Child 2: Reminder(name="Reminder", mqtt=mqtt) (always last).
-2. Error Handling:
-   - All code must be in try-except block
-   - Log errors using: logging.error(f"{filename} - Error message")
-3. MQTT Variables:
-   - person_state: "fallen", "not_fallen", or "None" (if no person is found).
-   - answer: User's response to AskQuestion.
-4. Node declarations and child assignments:
-   - First, declare all nodes (including composite nodes like Sequence, Selector, and leaf nodes like Action, Condition).
-   - Then, in a separate section, add all children.
-
-Example Output Format:
-Command:
-"Temi, go to the kitchen and say 'Hello, my name is Temi'"
-
-Generated create_behavior_tree():
-def create_behavior_tree(mqtt):
-    try:
-        # Behavior Tree Nodes declarations
-        root = py_trees.composites.Sequence(name="Root", memory=True)
-        sequence1 = py_trees.composites.Sequence(name="sequence1", memory=True)
-        move_destination = MoveToDestination(name="GoToKitchen", destination="kitchen", mqtt=mqtt)
-        speak_message = SpeakMessage(name="SayHello", message="Hello, my name is Temi", mqtt=mqtt)
-        reminder = Reminder(name="Reminder", mqtt=mqtt)
-        
-        # Child assignments
-        sequence1.add_children([move_destination, speak_message])
-        failure_is_success = py_trees.decorators.FailureIsSuccess(name = "failure_is_success", child = sequence1)
-    
-        # Add branches to root
-        root.add_children([failure_is_success, reminder])
-    
-        return root
-    except Exception as e:
-        logging.error(f"Error in create_behavior_tree: {e}")
-
-Critical Rules:
-1. If command is unclear, the generated output should ONLY inform the user about why the command is unclear and ask them to try again in less than 20 words, and don’t generate any code.
-2. For unsupported actions, the generated output should ONLY inform the user about why the robot can't do that, and don’t generate any code.
-3. The assistant should ONLY generate the create_behavior_tree() function.
-4. Root always has only two children, the failure is success decorator and the reminder node.
-5. Use Condition nodes to check variables when needed (after asking a question and using FallDetection node.
-6. SpeakMessage outputs should be clear and helpful for elderly users
-7. Sequence and Selector nodes always have memory = True
-8. To implement if / else if / else logic, use a Selector (memory=True) with child Sequences that begin with Condition nodes and include the corresponding actions; the Selector returns SUCCESS on the first valid branch.
-9. Input messages are captured from voice, so if a requested location, action or contact resembles to an available one, select it.
-Input:
-
-        
-                    """
-
-    if initial_message:
-        historic.append({"role": "system", "content": default_prompt})
-        initial_message = False
-        
-    historic.append({"role": "user", "content": message})
-    
-    data = {
-        "model": "gpt-4o",
-        "messages": historic,
-        "max_tokens": 1000
-    }
+# Sends the message to ChatGPT, after the prompt and the history of the user,
+# and returns the response. With Stream: True (LLM section of config.txt) the
+# response is streamed, and on_code is called with the response received so
+# far as soon as its code block is complete
+def send_to_chatgpt(message, prompt, user=None, on_code=None):  
+    messages = histories.add(user, "user", message)
     
     try:
-        response = requests.post(CHATGPT_URL, headers=headers, json=data)
-        reply = response.json()["choices"][0]["message"]["content"]
+        if llm.streaming:
+            parser = CodeFenceParser()
+            for chunk in llm.stream(messages, model="gpt-4o", max_tokens=1000, cache_key=prompt.fingerprint):
+                if parser.feed(chunk) is not None and on_code is not None:
+                    on_code(parser.text.strip())
+            reply = parser.text
+        else:
+            reply = llm.complete(messages, model="gpt-4o", max_tokens=1000, cache_key=prompt.fingerprint)
         # Add the response to the history for context in future responses
-        historic.append({"role": "assistant", "content": reply})
+        histories.add(user, "assistant", reply)
         return reply.strip()
     except Exception as e:
         return f"API Error: {e}"
 
+# Sends a command to ChatGPT and publishes the response (worker thread).
+# A streamed response is published as soon as its code is complete, so that
+# Clarifier and BT_Tester do not wait for the end of the stream
+def process_command(client, user, text, request_id, prompt):
+    published = []
+
+    # Publish the response to Clarifier module
+    def publish(response):
+        print(f"ChatGPT response: {response}")
+        published.append(response)
+        response = json.dumps({"correction":"False", "user": user, "response": response, "id": request_id})
+        client.publish(TOPIC_OUT, response)
+
+    response = send_to_chatgpt(text, prompt, user, on_code=publish)
+    if not published:
+        publish(response)
+
 
 # Handles messages received on chatgpt/input
 def on_message(client, userdata, msg):  
     global TOPIC_IN
     global finished_plan_topic
-    global initial_message
-    global historic
     if msg.topic == TOPIC_IN:
         message = json.loads(msg.payload.decode())  # Decode JSON
         user = message.get("user")
         text = message.get("message")
         print(f"Received message: {text}")
-
-        # Sends to ChatGPT and get response
-        response = send_to_chatgpt(text)
-        print(f"ChatGPT response: {response}")
-           
-        # Publish the response to Clarifier module
-        response = json.dumps({"correction":"False", "user": user, "response": response})
-        client.publish(TOPIC_OUT, response)
+        request_id = uuid.uuid4().hex
+        # Checks if the prompt file has changed
+        prompt = prompts.get(BT_GENERATION_PROMPT)
+
+        # A repeated command reuses its validated BT without asking ChatGPT,
+        # unless it continues a conversation (e.g. a clarification is open)
+        code = None
+        if not histories.has_history(user):
+            command = normalize_command(text, vocabulary)
+            pending_commands.put(request_id, command)
+            code = command_cache.get(command)
+        if code is not None:
+            print(f"Command cache hit: {command}")
+            response = json.dumps({"correction":"False", "user": user,
+                                   "response": f"```python\n{code}```", "id": request_id})
+            client.publish(TOPIC_OUT, response)
+        else:
+            # Sends to ChatGPT in a worker thread, so that MQTT is not blocked
+            llm.submit(process_command, client, user, text, request_id, prompt)
+    # BTs validated by BT_Tester (also corrected ones) are stored for their command
+    if msg.topic == VALIDATED_TOPIC:
+        message = json.loads(msg.payload.decode())
+        command = pending_commands.get(message.get("id"))
+        if command is not None and message.get("response"):
+            command_cache.put(command, message.get("response"))
     if msg.topic == finished_plan_topic:
         print(("Plan finished"))
-        initial_message = True
-        historic = []
+        # The conversation of the user ends with the plan
+        message = json.loads(msg.payload.decode())
+        histories.clear(message.get("user"))
 
 # Configure MQTT client
 client = mqtt.Client()
@@ -189,6 +160,7 @@ client.connect(broker, port)
 # Subscribe to input topic
 client.subscribe(TOPIC_IN)
 client.subscribe(finished_plan_topic)
+client.subscribe(VALIDATED_TOPIC)
 print("Waiting for messages on", TOPIC_IN)
 
 client.loop_forever()
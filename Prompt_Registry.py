@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+@author: smerino
+"""
+
+import os
+import logging
+import hashlib
+import threading
+from collections import namedtuple
+
+# System prompts of the LLM modules
+BT_GENERATION_PROMPT = "BT_Generation_prompt.txt"
+FAILURE_INTERPRETER_PROMPT = "Failure_Interpreter_prompt.txt"
+
+# Loaded prompt: text and fingerprint (version) of its file
+Prompt = namedtuple("Prompt", ["path", "text", "fingerprint"])
+
+
+def prompt_fingerprint(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+# -------------------------------------------------------
+# PromptRegistry
+# -------------------------------------------------------
+# System prompts loaded from their files. A file is read
+# once and only read again when its modification time or
+# size changes, so prompts can be edited while the modules
+# run. The functions subscribed to a prompt are called
+# when a new version is loaded, to invalidate what
+# depends on it (histories, cached BTs). If a file cannot
+# be read, the last loaded version is kept.
+class PromptRegistry():
+    def __init__(self):
+        self.prompts = {}     # path -> (Prompt, stamp of the file)
+        self.listeners = {}   # path -> [callback(prompt)]
+        self.lock = threading.Lock()
+
+    # Current version of a prompt
+    def get(self, path):
+        with self.lock:
+            prompt, stamp = self.prompts.get(path, (None, None))
+            try:
+                status = os.stat(path)
+                new_stamp = (status.st_mtime_ns, status.st_size)
+                if new_stamp == stamp:
+                    return prompt
+                with open(path, "r", encoding="utf-8") as file:
+                    text = file.read()
+            except OSError as e:
+                if prompt is None:
+                    raise
+                logging.error(f"{path} - Error reloading prompt: {e}")
+                return prompt
+            old_prompt = prompt
+            prompt = Prompt(path, text, prompt_fingerprint(text))
+            self.prompts[path] = (prompt, new_stamp)
+            listeners = list(self.listeners.get(path, []))
+
+        if old_prompt is not None and old_prompt.fingerprint != prompt.fingerprint:
+            print(f"Prompt {path} reloaded (version {prompt.fingerprint})")
+            for callback in listeners:
+                callback(prompt)
+        return prompt
+
+    # Calls callback(prompt) when a new version of the prompt is loaded
+    def subscribe(self, path, callback):
+        with self.lock:
+            self.listeners.setdefault(path, []).append(callback)
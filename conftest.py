@@ -5,3 +5,7 @@
 
 def pytest_addoption(parser):
     parser.addoption("--bt-code", action="store", help="BT code as a string")
+    parser.addoption("--bt-mode", action="store", default="coverage",
+                     help="Validation mode: coverage or exhaustive")
+    parser.addoption("--bt-workers", action="store", type=int, default=1,
+                     help="Worker processes for the exhaustive mode")
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+@author: smerino
+"""
+
+import threading
+import time
+import json
+import types
+import pytest
+from py_trees.common import Status
+from BT_classes import receiveTopics, RobotState, MoveToDestination, Condition
+
+
+# receiveTopics that records the published messages instead of using the broker
+class FakeTopics(receiveTopics):
+    def __init__(self):
+        super().__init__()
+        self.published = []
+
+    def publish_mqtt(self, topic, message):
+        self.published.append((topic, message))
+
+
+@pytest.fixture
+def mqtt():
+    return FakeTopics()
+
+
+def paused_move(mqtt):
+    move = MoveToDestination("GoToKitchen", "kitchen", mqtt)
+    move.tick_once()
+    mqtt.status_description_id = "1005"
+    move.tick_once()
+    return move
+
+
+def test_move_pause_does_not_block_the_tick(mqtt):
+    move = paused_move(mqtt)
+    start = time.time()
+    move.tick_once()
+    assert time.time() - start < 0.5
+    assert move.status == Status.RUNNING
+    assert move.paused
+    assert mqtt.published[-1][0].endswith("/input/system/click_button")
+
+
+def test_move_pause_yes_ends_the_movement(mqtt):
+    move = paused_move(mqtt)
+    mqtt.response = "yes"
+    move.tick_once()
+    assert move.status == Status.SUCCESS
+    assert not move.paused
+
+
+def test_move_pause_no_restarts_the_movement(mqtt):
+    move = paused_move(mqtt)
+    mqtt.response = "no"
+    move.tick_once()
+    assert move.status == Status.RUNNING
+    assert not move.robot_moving
+    move.tick_once()
+    assert mqtt.published[-1][0].endswith("/input/movement/move_dest")
+
+
+def test_move_pause_times_out(mqtt):
+    move = paused_move(mqtt)
+    assert move.deadline() == move.pause_timer + move.max_pause_time
+    move.pause_timer -= move.max_pause_time + 1
+    move.tick_once()
+    assert move.status == Status.FAILURE
+
+
+def test_preempted_move_stops_the_robot(mqtt):
+    move = MoveToDestination("GoToKitchen", "kitchen", mqtt)
+    move.tick_once()
+    move.stop(Status.INVALID)
+    assert mqtt.published[-1][0].endswith("/input/movement/stop")
+    assert not move.robot_moving
+    published = len(mqtt.published)
+    move.stop(Status.INVALID)
+    assert len(mqtt.published) == published
+
+
+def test_condition_does_not_block(mqtt):
+    mqtt.answer = "yes"
+    condition = Condition("AnswerIsYes", "answer", "yes", mqtt)
+    start = time.time()
+    condition.tick_once()
+    assert time.time() - start < 0.5
+    assert condition.status == Status.SUCCESS
+    mqtt.answer = "no"
+    condition.tick_once()
+    assert condition.status == Status.FAILURE
+
+
+def test_condition_waits_for_value(mqtt):
+    mqtt.person_state = None
+    condition = Condition("PersonFound", "person_state", "fallen", mqtt, timeout=10)
+    condition.tick_once()
+    assert condition.status == Status.RUNNING
+    assert condition.deadline() == condition.wait_timer + 10
+    mqtt.person_state = "fallen"
+    condition.tick_once()
+    assert condition.status == Status.SUCCESS
+
+
+def test_condition_wait_times_out(mqtt):
+    condition = Condition("PersonFound", "person_state", "fallen", mqtt, timeout=10)
+    condition.tick_once()
+    condition.wait_timer -= 11
+    condition.tick_once()
+    assert condition.status == Status.FAILURE
+
+
+def test_state_versions_only_change_with_the_value():
+    state = RobotState()
+    state.set("speaking", "1")
+    version = state.version("speaking")
+    state.set("speaking", "1")
+    assert state.version("speaking") == version
+    state.set("speaking", "0")
+    assert state.version("speaking") > version
+
+
+def test_state_wait_for_change_and_subscribe(mqtt):
+    changes = []
+    mqtt.state.subscribe(lambda key, value: changes.append((key, value)), keys=["end_call"])
+    version = mqtt.state.version()
+    threading.Timer(0.1, setattr, (mqtt, "end_call", True)).start()
+    assert mqtt.state.wait_for_change(version, timeout=5, keys=["end_call"])
+    assert mqtt.end_call is True
+    assert changes == [("end_call", True)]
+    assert not mqtt.state.wait_for_change(mqtt.state.version(), timeout=0.05)
+
+
+def test_state_swap_and_compare_and_set(mqtt):
+    mqtt.response = "yes"
+    assert mqtt.state.swap("response", "") == "yes"
+    assert mqtt.response == ""
+    assert not mqtt.state.compare_and_set("response", "no", "")
+    mqtt.reset_state()
+    assert mqtt.state.snapshot() == RobotState.FIELDS
+
+
+def robot_message(mqtt, topic, data):
+    payload = json.dumps(data).encode("utf-8")
+    return types.SimpleNamespace(topic=mqtt.topic_header + topic, payload=payload)
+
+
+def test_messages_are_dispatched_by_topic(mqtt):
+    mqtt.process_message(None, None, robot_message(mqtt, "/output/info/movement/status",
+                                                   {"status": "complete", "command": "goto", "descriptionId": "0"}))
+    mqtt.process_message(None, None, robot_message(mqtt, "/output/info/media/speak", {"status": "0"}))
+    mqtt.process_message(None, None, robot_message(mqtt, "/output/info/imagen", {"ignored": True}))
+    assert mqtt.robot_status == "complete"
+    assert mqtt.status_description_id == "0"
+    assert mqtt.speaking == "0"
+
+
+def test_handlers_can_be_registered(mqtt):
+    received = []
+    mqtt.register_handler("/output/info/battery", received.append)
+    mqtt.process_message(None, None, robot_message(mqtt, "/output/info/battery", {"level": 80}))
+    assert received == [{"level": 80}]
+
+
+def test_invalid_payload_is_logged_not_raised(mqtt):
+    message = types.SimpleNamespace(topic=mqtt.topic_header + "/output/info/menu", payload=b"not json")
+    mqtt.process_message(None, None, message)
+    assert mqtt.menu == ""
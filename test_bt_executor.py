@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+@author: smerino
+"""
+
+import json
+import threading
+import time
+import types
+import pytest
+import BT_Executor
+from BT_classes import receiveTopics
+from BT_Host import ExecutionHost
+from BT_Executor import Plan, PlanQueue, Planner
+
+
+def plan(identifier, priority, correction="False"):
+    return Plan(identifier, priority, "Anna", f"task_{priority}_{identifier}.py", correction)
+
+
+def test_queue_orders_by_correction_priority_and_age():
+    queue = PlanQueue()
+    for p in [plan(0, 1), plan(1, 3), plan(2, 1, correction="True"), plan(3, 3), plan(4, 2)]:
+        queue.push(p)
+    assert [p.identifier for p in queue.plans()] == [2, 1, 3, 4, 0]
+    assert queue.peek().identifier == 2
+    assert [queue.pop().identifier for _ in range(5)] == [2, 1, 3, 4, 0]
+    assert queue.pop() is None
+    assert queue.peek() is None
+
+
+def test_cancelled_plan_is_skipped():
+    queue = PlanQueue()
+    for p in [plan(0, 3), plan(1, 2), plan(2, 1)]:
+        queue.push(p)
+    assert queue.cancel(0).identifier == 0
+    assert queue.cancel(0) is None
+    assert len(queue) == 2
+    assert queue.peek().identifier == 1
+    assert [queue.pop().identifier for _ in range(2)] == [1, 2]
+
+
+def test_reprioritized_plan_moves():
+    queue = PlanQueue()
+    for p in [plan(0, 3), plan(1, 2), plan(2, 1)]:
+        queue.push(p)
+    assert queue.reprioritize(2, 5)
+    assert not queue.reprioritize(7, 5)
+    assert [p.identifier for p in queue.plans()] == [2, 0, 1]
+    assert len(queue) == 3
+    assert [queue.pop().identifier for _ in range(3)] == [2, 0, 1]
+
+
+def test_pushing_a_queued_plan_again_replaces_it():
+    queue = PlanQueue()
+    first = plan(0, 1)
+    queue.push(first)
+    queue.push(plan(1, 2))
+    queue.push(first)
+    assert len(queue) == 2
+    assert [queue.pop().identifier for _ in range(2)] == [1, 0]
+
+
+SUCCESS_BT = """
+def create_behavior_tree(mqtt):
+    return py_trees.behaviours.Success(name="Done")
+"""
+
+RUNNING_BT = """
+def create_behavior_tree(mqtt):
+    return py_trees.behaviours.Running(name="Forever")
+"""
+
+FAILING_BT = """
+def create_behavior_tree(mqtt):
+    raise ValueError("invalid tree")
+"""
+
+
+# MQTT client that records the published messages instead of using the broker
+class FakeClient():
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload):
+        self.published.append((topic, json.loads(payload)))
+
+    def username_pw_set(self, *args):
+        pass
+
+    def connect(self, *args):
+        pass
+
+    def subscribe(self, *args):
+        pass
+
+    def message_callback_add(self, *args):
+        pass
+
+    def loop_start(self):
+        pass
+
+
+# Planner running its scheduler in a thread, with an in-process host
+@pytest.fixture
+def planner(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(BT_Executor.mqtt, "Client", FakeClient)
+    monkeypatch.setattr(BT_Executor, "ExecutionHost", lambda: ExecutionHost(mqtt=receiveTopics()))
+    planner = Planner()
+    planner.preemption = True
+    planner.requeue_preempted = True
+    thread = threading.Thread(target=run_until_stopped, args=(planner,), daemon=True)
+    thread.start()
+    yield planner
+    while planner.execution_queue.pop() is not None:
+        pass
+    active = planner.active_plan
+    if active is not None:
+        active.stop_event.set()
+        wait_for(lambda: planner.active_plan is None)
+    planner.loop.call_soon_threadsafe(planner.loop.stop)
+    thread.join(5)
+
+
+# The scheduler runs until the event loop is stopped
+def run_until_stopped(planner):
+    try:
+        planner.run()
+    except RuntimeError:
+        pass
+
+
+def send_plan(planner, identifier, priority, body, correction="False"):
+    payload = {"correction": correction, "user": "Anna", "priority": priority,
+               "identifier": identifier, "body": body, "id": f"request{identifier}"}
+    planner.on_message(None, None, types.SimpleNamespace(payload=json.dumps(payload).encode("utf-8")))
+
+
+def wait_for(condition, timeout=5):
+    end = time.time() + timeout
+    while time.time() < end:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def finished(planner):
+    return [message["user"] for topic, message in planner.client.published if topic == "plan/finished"]
+
+
+def test_higher_priority_plan_preempts_and_requeues(planner):
+    send_plan(planner, 0, 1, RUNNING_BT)
+    assert wait_for(lambda: planner.active_plan is not None and planner.active_plan.identifier == 0)
+    send_plan(planner, 1, 3, SUCCESS_BT)
+    assert wait_for(lambda: finished(planner) == ["Anna"])
+    assert wait_for(lambda: planner.active_plan is not None and planner.active_plan.identifier == 0)
+
+
+def test_correction_does_not_hide_an_urgent_plan(planner):
+    active = plan(0, 2)
+    active.stop_event = threading.Event()
+    planner.active_plan = active
+    planner.execution_queue.push(plan(1, 1, correction="True"))
+    planner.execution_queue.push(plan(2, 5))
+    planner.check_preemption()
+    assert active.preempted
+    assert active.stop_event.is_set()
+    planner.active_plan = None
+
+
+def test_queue_resumes_when_the_correction_does_not_arrive(planner):
+    planner.correction_timeout = 0.3
+    send_plan(planner, 0, 1, FAILING_BT)
+    assert wait_for(lambda: any(topic == "Failure_Interpreter/input" for topic, _ in planner.client.published))
+    send_plan(planner, 1, 1, SUCCESS_BT)
+    time.sleep(0.1)
+    assert finished(planner) == []
+    assert wait_for(lambda: finished(planner) == ["Anna"])
+
+
+def test_correction_runs_before_the_timeout(planner):
+    send_plan(planner, 0, 1, FAILING_BT)
+    assert wait_for(lambda: any(topic == "Failure_Interpreter/input" for topic, _ in planner.client.published))
+    send_plan(planner, 1, 1, SUCCESS_BT, correction="True")
+    assert wait_for(lambda: finished(planner) == ["Anna"])
+    assert planner.correction_timer is None
+
+
+def test_urgent_plan_does_not_wait_for_the_correction(planner):
+    send_plan(planner, 0, 1, FAILING_BT)
+    assert wait_for(lambda: planner.correction_timer is not None)
+    send_plan(planner, 1, 1, SUCCESS_BT)
+    send_plan(planner, 2, 3, SUCCESS_BT)
+    assert wait_for(lambda: finished(planner) == ["Anna"] * 2, timeout=2)
+    assert planner.correction_timer is None
+    send_plan(planner, 3, 1, SUCCESS_BT, correction="True")
+    assert wait_for(lambda: finished(planner) == ["Anna"] * 3, timeout=2)
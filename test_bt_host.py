@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+@author: smerino
+"""
+
+import shutil
+import threading
+import time
+import pytest
+from py_trees.common import Status
+from BT_classes import receiveTopics, TickScheduler
+from BT_Host import ExecutionHost, WorkerPool, PREEMPTED
+from BT_Plan import plan_source
+
+SUCCESS_BT = """
+def create_behavior_tree(mqtt):
+    root = py_trees.composites.Sequence(name="Root", memory=True)
+    root.add_children([py_trees.behaviours.Success(name="Done")])
+    return root
+"""
+
+RUNNING_BT = """
+def create_behavior_tree(mqtt):
+    root = py_trees.composites.Sequence(name="Root", memory=True)
+    root.add_children([py_trees.behaviours.Running(name="Forever")])
+    return root
+"""
+
+
+CRASH_BT = """
+def create_behavior_tree(mqtt):
+    os._exit(3)
+"""
+
+
+# Plans write log.txt in the working directory
+@pytest.fixture
+def host(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return ExecutionHost(mqtt=receiveTopics(), cache_size=2)
+
+
+def test_plan_runs_from_memory(host):
+    assert host.run_plan("task_2_0.py", plan_source(SUCCESS_BT)) == 0
+
+
+def test_repeated_plan_is_compiled_once(host):
+    source = plan_source(SUCCESS_BT)
+    assert host.run_plan("task_2_0.py", source) == 0
+    code = host.compile_plan("task_2_1.py", source)
+    assert host.run_plan("task_2_1.py", source) == 0
+    assert len(host.compiled) == 1
+    assert host.compile_plan("task_2_2.py", source) is code
+
+
+def test_compiled_plans_are_evicted(host):
+    for i in range(3):
+        host.compile_plan(f"task_2_{i}.py", plan_source(SUCCESS_BT + f"\n# {i}\n"))
+    assert len(host.compiled) == 2
+
+
+def test_stop_event_preempts_plan(host):
+    stop_event = threading.Event()
+    stop_event.set()
+    assert host.run_plan("task_1_0.py", plan_source(RUNNING_BT), stop_event) == PREEMPTED
+
+
+# Spawned workers read config.txt from the working directory
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    shutil.copy("config.txt", tmp_path)
+    monkeypatch.chdir(tmp_path)
+    pool = WorkerPool(1)
+    yield pool
+    pool.close()
+
+
+def test_pool_runs_plan(pool):
+    assert pool.run_plan("task_2_0.py", plan_source(SUCCESS_BT)) == 0
+
+
+def test_pool_preempts_plan(pool):
+    stop_event = threading.Event()
+    threading.Timer(0.3, stop_event.set).start()
+    assert pool.run_plan("task_1_0.py", plan_source(RUNNING_BT), stop_event) == PREEMPTED
+    assert pool.run_plan("task_2_0.py", plan_source(SUCCESS_BT)) == 0
+
+
+def test_crashed_worker_is_replaced(pool):
+    pid = pool.workers.queue[0][0].pid
+    assert pool.run_plan("task_1_0.py", plan_source(CRASH_BT)) == 1
+    assert pool.workers.queue[0][0].pid != pid
+    assert pool.run_plan("task_2_0.py", plan_source(SUCCESS_BT)) == 0
+
+
+def test_killed_worker_is_replaced(pool):
+    process = pool.workers.queue[0][0]
+    process.kill()
+    process.join(5)
+    assert pool.run_plan("task_2_0.py", plan_source(SUCCESS_BT)) == 0
+    assert pool.workers.queue[0][0].pid != process.pid
+    assert pool.run_plan("task_2_0.py", plan_source(SUCCESS_BT)) == 0
+
+
+def running_tree():
+    namespace = {}
+    exec("import py_trees\n" + RUNNING_BT, namespace)
+    tree = namespace["create_behavior_tree"](None)
+    tree.tick_once()
+    return tree
+
+
+def test_scheduler_wakes_on_robot_state_change():
+    mqtt = receiveTopics()
+    tree = running_tree()
+    scheduler = TickScheduler(mqtt, max_tick_rate=100, idle_tick_period=10)
+    scheduler.tick(tree)
+    threading.Timer(0.2, mqtt.state.set, ("robot_status", "complete")).start()
+    start = time.time()
+    assert scheduler.wait(tree) is False
+    assert 0.15 < time.time() - start < 2
+
+
+def test_scheduler_limits_tick_rate():
+    mqtt = receiveTopics()
+    tree = running_tree()
+    scheduler = TickScheduler(mqtt, max_tick_rate=4, idle_tick_period=10)
+    scheduler.tick(tree)
+    changer = threading.Thread(target=mqtt.state.set, args=("speaking", "0"))
+    changer.start()
+    changer.join()
+    start = time.time()
+    scheduler.wait(tree)
+    assert 0.2 <= time.time() - start < 2
+
+
+def test_scheduler_wakes_on_node_deadline():
+    mqtt = receiveTopics()
+    tree = running_tree()
+    forever = tree.children[0]
+    forever.deadline = lambda: time.time() + 0.2
+    scheduler = TickScheduler(mqtt, max_tick_rate=100, idle_tick_period=10)
+    scheduler.tick(tree)
+    start = time.time()
+    scheduler.wait(tree)
+    assert 0.15 < time.time() - start < 2
+
+
+def test_scheduler_ignores_changes_made_by_the_tree():
+    mqtt = receiveTopics()
+    tree = running_tree()
+    forever = tree.children[0]
+    forever.update = lambda: (mqtt.state.set("speaking", str(time.time())), Status.RUNNING)[1]
+    scheduler = TickScheduler(mqtt, max_tick_rate=100, idle_tick_period=0.3)
+    scheduler.tick(tree)
+    start = time.time()
+    scheduler.wait(tree)
+    assert time.time() - start >= 0.25
+
+
+def test_scheduler_wakes_on_change_during_the_tick():
+    mqtt = receiveTopics()
+    tree = running_tree()
+    forever = tree.children[0]
+    answer = threading.Thread(target=mqtt.state.set, args=("response", "yes"))
+    forever.update = lambda: (answer.start(), answer.join(), Status.RUNNING)[2]
+    scheduler = TickScheduler(mqtt, max_tick_rate=100, idle_tick_period=10)
+    scheduler.tick(tree)
+    start = time.time()
+    scheduler.wait(tree)
+    assert time.time() - start < 1
+
+
+def test_scheduler_waits_for_the_keys_of_the_running_nodes():
+    mqtt = receiveTopics()
+    tree = running_tree()
+    forever = tree.children[0]
+    forever.state_keys = lambda: ("speaking",)
+    scheduler = TickScheduler(mqtt, max_tick_rate=100, idle_tick_period=10)
+    scheduler.tick(tree)
+    for delay, location in [(0.1, "kitchen"), (0.2, "hall")]:
+        threading.Timer(delay, mqtt.state.set, ("location_mqtt", location)).start()
+    threading.Timer(0.4, mqtt.state.set, ("speaking", "0")).start()
+    start = time.time()
+    assert scheduler.wait(tree) is False
+    assert 0.35 < time.time() - start < 2
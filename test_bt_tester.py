@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+@author: smerino
+"""
+
+import json
+import os
+import pytest
+import BT_Tester
+from BT_Cache import LRUCache
+
+VALID_BT = """
+def create_behavior_tree(mqtt):
+    root = py_trees.composites.Sequence(name="Root", memory=True)
+    root.add_children([MoveToDestination(name="Go", destination="kitchen", mqtt=mqtt)])
+    return root
+"""
+
+
+# MQTT client that records the published messages
+class FakeClient():
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload):
+        self.published.append((topic, json.loads(payload)))
+
+
+# Scratch files are written in the working directory
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(BT_Tester, "validation_cache", LRUCache(8))
+    return FakeClient()
+
+
+def request(request_id, code=VALID_BT):
+    return {"correction": "False", "user": "Anna", "response": code, "id": request_id}
+
+
+def test_passed_bt_is_sent_to_the_planner(client):
+    request_id = "a" * 32
+    BT_Tester.run_job(client, request(request_id))
+    assert client.published == [("BT_Planner/input", {"correction": "False", "user": "Anna",
+                                                      "response": VALID_BT, "id": request_id})]
+
+
+def test_invalid_request_id_is_replaced(client, tmp_path):
+    BT_Tester.run_job(client, request("../../escaped", code="def create_behavior_tree(mqtt):\n    return None\n"))
+    topic, payload = client.published[0]
+    assert topic == "Failure_Interpreter/input"
+    assert BT_Tester.REQUEST_ID.fullmatch(payload["id"])
+    assert payload["filename"] == f"BT_Tester_fail_{payload['id']}.py"
+    assert os.listdir(tmp_path) == [payload["filename"]]
+
+
+def test_crashed_job_reports_a_failure(client, monkeypatch):
+    def crash(*args, **kwargs):
+        raise MemoryError("out of memory")
+    monkeypatch.setattr(BT_Tester, "validate_bt", crash)
+    request_id = "b" * 32
+    BT_Tester.run_job(client, request(request_id))
+    topic, payload = client.published[0]
+    assert topic == "Failure_Interpreter/input"
+    assert payload["id"] == request_id
+    assert "out of memory" in payload["error"]
+    with open(payload["filename"], encoding="utf-8") as f:
+        assert f.read() == VALID_BT
+
+
+def test_analysis_error_fails_the_validation(client, monkeypatch):
+    def analysis_error(code):
+        raise RecursionError("maximum recursion depth exceeded")
+    monkeypatch.setattr(BT_Tester, "analyse_bt", analysis_error)
+    monkeypatch.setattr(BT_Tester, "validate_bt", None)
+    BT_Tester.run_job(client, request("c" * 32))
+    topic, payload = client.published[0]
+    assert topic == "Failure_Interpreter/input"
+    assert payload["error"] == "Error in code: maximum recursion depth exceeded"
+    assert len(BT_Tester.validation_cache) == 0
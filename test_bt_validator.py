@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+@author: smerino
+"""
+
+import random
+import pytest
+from BT_Analyzer import analyse_bt
+from BT_Validator import DummyBT, validate_bt, coverage_search, pruned_search, exhaustive_search, parallel_search
+
+# Example BT following the structure requested to the LLM
+EXAMPLE_BT = """
+def create_behavior_tree(mqtt):
+    root = py_trees.composites.Sequence(name="Root", memory=True)
+    selector = py_trees.composites.Selector(name="selector", memory=True)
+    seq_fallen = py_trees.composites.Sequence(name="seq_fallen", memory=True)
+    seq_ok = py_trees.composites.Sequence(name="seq_ok", memory=True)
+    main = py_trees.composites.Sequence(name="main", memory=True)
+    move = MoveToDestination(name="GoToKitchen", destination="kitchen", mqtt=mqtt)
+    detect = DetectFall(name="Detect", mqtt=mqtt)
+    cond_fallen = Condition(name="IsFallen", variable="person_state", value="fallen", mqtt=mqtt)
+    call = Videoconference(name="CallEmergency", contact="emergency", mqtt=mqtt)
+    cond_ok = Condition(name="IsOk", variable="person_state", value="not_fallen", mqtt=mqtt)
+    speak = SpeakMessage(name="SayHello", message="Hello", mqtt=mqtt)
+    alert = Alert(name="AlertDavid", message="Nobody found", contact="David", mqtt=mqtt)
+    reminder = Reminder(name="Reminder", mqtt=mqtt)
+
+    seq_fallen.add_children([cond_fallen, call])
+    seq_ok.add_children([cond_ok, speak])
+    selector.add_children([seq_fallen, seq_ok, alert])
+    main.add_children([move, detect, selector])
+    failure_is_success = py_trees.decorators.FailureIsSuccess(name="failure_is_success", child=main)
+    root.add_children([failure_is_success, reminder])
+    return root
+"""
+
+COMPOSITES = ["Sequence", "Selector", "Parallel"]
+DECORATORS = ["Inverter", "FailureIsSuccess", "SuccessIsFailure", "FailureIsRunning",
+              "SuccessIsRunning", "RunningIsFailure", "RunningIsSuccess", "PassThrough"]
+
+
+# Generates the source of a random create_behavior_tree() with
+# at most max_leaves action nodes
+def random_bt_code(rng, max_leaves=8):
+    lines = ["def create_behavior_tree(mqtt):"]
+    counter = [0, 0]
+
+    def new_node(depth):
+        counter[0] += 1
+        var = f"node{counter[0]}"
+        kind = rng.random()
+        if depth > 3 or counter[1] >= max_leaves or kind < 0.4:
+            counter[1] += 1
+            lines.append(f"    {var} = SpeakMessage(name=\"Action{counter[1]}\", message=\"-\", mqtt=mqtt)")
+        elif kind < 0.6:
+            child = new_node(depth + 1)
+            decorator = rng.choice(DECORATORS)
+            lines.append(f"    {var} = py_trees.decorators.{decorator}(name=\"{var}\", child={child})")
+        else:
+            composite = rng.choice(COMPOSITES)
+            children = [new_node(depth + 1) for _ in range(rng.randint(1, 3))]
+            if composite == "Parallel":
+                policy = rng.choice(["SuccessOnAll()", "SuccessOnOne()"])
+                lines.append(f"    {var} = py_trees.composites.Parallel(name=\"{var}\", "
+                             f"policy=py_trees.common.ParallelPolicy.{policy})")
+            else:
+                lines.append(f"    {var} = py_trees.composites.{composite}(name=\"{var}\", memory=True)")
+            lines.append(f"    {var}.add_children([{', '.join(children)}])")
+        return var
+
+    root = new_node(0)
+    lines.append(f"    return {root}")
+    return "\n".join(lines) + "\n"
+
+
+def test_example_bt_passes():
+    result = validate_bt(EXAMPLE_BT)
+    assert result["result"] == "PASSED", result["error"]
+
+
+def test_unreachable_node_is_reported():
+    bt_code = EXAMPLE_BT.replace(
+        "selector.add_children([seq_fallen, seq_ok, alert])",
+        "fis = py_trees.decorators.FailureIsSuccess(name=\"fis\", child=seq_ok)\n"
+        "    selector.add_children([seq_fallen, fis, alert])")
+    result = validate_bt(bt_code)
+    assert result["result"] == "FAILED"
+    assert "AlertDavid" in result["error"]
+
+
+def test_duplicated_node_is_reported():
+    bt_code = EXAMPLE_BT.replace('name="SayHello"', 'name="GoToKitchen"')
+    result = validate_bt(bt_code, mode="exhaustive")
+    assert result["error"] == "Duplicated node names: ['GoToKitchen']"
+    assert result["runs"] == 0
+
+
+def test_duplicated_node_is_reported_from_the_facts_without_executing():
+    bt_code = EXAMPLE_BT.replace('name="SayHello"', 'name="GoToKitchen"').replace("return root", "return undefined")
+    assert validate_bt(bt_code)["error"].startswith("Error in code")
+    result = validate_bt(bt_code, facts=analyse_bt(bt_code))
+    assert result["error"] == "Duplicated node names: ['GoToKitchen']"
+    assert result["runs"] == 0
+
+
+def test_exhaustive_stops_when_every_node_is_ticked():
+    result = validate_bt(EXAMPLE_BT, mode="exhaustive")
+    assert result["result"] == "PASSED"
+    assert 0 < result["runs"] < 2 ** len(result["nodes"])
+
+
+def test_analyse_bt_reads_facts_without_executing():
+    bt_code = EXAMPLE_BT.replace("def create_behavior_tree(mqtt):\n", "def create_behavior_tree(mqtt):\n  try:\n")
+    bt_code += "  except Exception as e:\n    logging.error(f\"Error in create_behavior_tree: {e}\")\n"
+    facts = analyse_bt(bt_code)
+    assert facts.root == "root"
+    assert facts.action_names() == ["GoToKitchen", "Detect", "IsFallen", "CallEmergency",
+                                    "IsOk", "SayHello", "AlertDavid", "Reminder"]
+    assert facts.children("failure_is_success") == ["main"]
+    assert facts.children("selector") == ["seq_fallen", "seq_ok", "alert"]
+    assert facts.condition_variables == ["person_state", "person_state"]
+    assert facts.destinations == ["kitchen"]
+    assert facts.contacts == ["emergency", "David"]
+
+
+def test_analyse_bt_finds_nodes_built_inline():
+    bt_code = """
+def create_behavior_tree(mqtt):
+    root = py_trees.composites.Sequence(name="Root", memory=True)
+    root.add_children([
+        MoveToDestination(name="GoToKitchen", destination="kitchen", mqtt=mqtt),
+        py_trees.decorators.Inverter(name="NotFallen",
+                                     child=Condition(name="IsFallen", variable="person_state", value="fallen", mqtt=mqtt)),
+    ])
+    root.add_child(SpeakMessage(name="SayHello", message="Hello", mqtt=mqtt))
+    return root
+"""
+    facts = analyse_bt(bt_code)
+    assert facts.root == "root"
+    assert facts.action_names() == ["GoToKitchen", "IsFallen", "SayHello"]
+    assert [facts.nodes[child]["name"] for child in facts.children("root")] == ["GoToKitchen", "NotFallen", "SayHello"]
+    inverter = facts.children("root")[1]
+    assert [facts.nodes[child]["name"] for child in facts.children(inverter)] == ["IsFallen"]
+    assert facts.condition_variables == ["person_state"]
+    assert facts.destinations == ["kitchen"]
+
+
+def test_analyse_bt_finds_nodes_built_in_blocks():
+    bt_code = """
+def create_behavior_tree(mqtt):
+    root = py_trees.composites.Sequence(name="Root", memory=True)
+    for room in ["kitchen", "bedroom"]:
+        move = MoveToDestination(name=f"GoTo{room}", destination=room, mqtt=mqtt)
+        root.add_child(move)
+    if mqtt is not None:
+        alert = Alert(name="AlertDavid", message="Hello", contact="David", mqtt=mqtt)
+        root.add_children([alert])
+    return root
+"""
+    facts = analyse_bt(bt_code)
+    assert facts.action_names() == [None, "AlertDavid"]
+    assert facts.children("root") == ["move", "alert"]
+    assert facts.destinations == [None]
+    assert facts.contacts == ["David"]
+
+
+# A OneShot keeps its status after stop(), so the tree must be built again for every run
+ONE_SHOT_BT = """
+def create_behavior_tree(mqtt):
+    root = py_trees.composites.Selector(name="Root", memory=True)
+    move = MoveToDestination(name="GoToKitchen", destination="kitchen", mqtt=mqtt)
+    once = py_trees.decorators.OneShot(name="once", child=move,
+                                       policy=py_trees.common.OneShotPolicy.ON_COMPLETION)
+    speak = SpeakMessage(name="SayHello", message="Hello", mqtt=mqtt)
+    root.add_children([once, speak])
+    return root
+"""
+
+
+@pytest.mark.parametrize("mode", ["coverage", "exhaustive"])
+def test_stateful_nodes_are_reset_between_runs(mode):
+    result = validate_bt(ONE_SHOT_BT, mode=mode)
+    assert result["result"] == "PASSED", result["error"]
+    assert result["runs"] > 1
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_coverage_matches_exhaustive(seed):
+    bt = DummyBT(random_bt_code(random.Random(seed)))
+    expected, _ = exhaustive_search(bt)
+    assert coverage_search(bt)[0] == expected
+    assert pruned_search(bt)[0] == expected
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_parallel_matches_serial(seed):
+    bt = DummyBT(random_bt_code(random.Random(seed), max_leaves=10))
+    assert parallel_search(bt, workers=2)[0] == exhaustive_search(bt)[0]
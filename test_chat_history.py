@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+@author: smerino
+"""
+
+from Chat_History import HistoryManager, count_tokens
+
+SYSTEM_PROMPT = "You are a Behavior Tree generator. " * 20
+
+
+def total_tokens(messages):
+    return sum(count_tokens(message["content"]) + 4 for message in messages)
+
+
+def test_system_prompt_is_pinned():
+    histories = HistoryManager(SYSTEM_PROMPT, max_tokens=400)
+    for i in range(50):
+        messages = histories.add("Anna", "user", f"Request {i}: go to the kitchen and say hello")
+        histories.add("Anna", "assistant", "def create_behavior_tree(mqtt): ..." * 3)
+    assert messages[0] == {"role": "system", "content": SYSTEM_PROMPT}
+    assert messages[-1]["content"].startswith("Request 49")
+
+
+def test_history_stays_within_the_budget():
+    histories = HistoryManager(SYSTEM_PROMPT, max_tokens=400)
+    for i in range(50):
+        messages = histories.add("Anna", "user", f"Request {i}: go to the kitchen")
+        assert total_tokens(messages) <= 400
+
+
+def test_evicted_requests_are_summarized():
+    histories = HistoryManager(SYSTEM_PROMPT, max_tokens=400, summary_tokens=50)
+    for i in range(20):
+        messages = histories.add("Anna", "user", f"Request {i}: go to the kitchen\n" + "x" * 200)
+    summary = messages[1]
+    assert summary["role"] == "system"
+    assert "Request 17: go to the kitchen" in summary["content"]
+    assert "x" * 200 not in summary["content"]
+    assert "Request 0:" not in summary["content"]
+
+
+def test_last_message_is_kept_over_the_budget():
+    histories = HistoryManager(SYSTEM_PROMPT, max_tokens=100)
+    messages = histories.add("Anna", "user", "x" * 2000)
+    assert messages[-1]["content"] == "x" * 2000
+
+
+def test_sessions_are_separate_and_bounded():
+    histories = HistoryManager(SYSTEM_PROMPT, max_tokens=1000, max_sessions=2)
+    histories.add("Anna", "user", "go to the kitchen")
+    messages = histories.add("David", "user", "call Sergio")
+    assert [m["content"] for m in messages[1:]] == ["call Sergio"]
+    histories.add("Sergio", "user", "say hello")
+    assert len(histories) == 2
+    assert histories.messages("Anna") == [histories.system_message()]
+
+
+def test_clear_session():
+    histories = HistoryManager(SYSTEM_PROMPT, max_tokens=1000)
+    assert not histories.has_history("Anna")
+    histories.add("Anna", "user", "go to the kitchen")
+    assert histories.has_history("Anna")
+    histories.add("David", "user", "call Sergio")
+    histories.clear("Anna")
+    assert not histories.has_history("Anna")
+    assert len(histories.messages("Anna")) == 1
+    assert len(histories.messages("David")) == 2
+    histories.clear()
+    assert len(histories) == 0
+
+
+def test_new_system_prompt_clears_the_histories():
+    histories = HistoryManager(SYSTEM_PROMPT, max_tokens=1000)
+    histories.add("Anna", "user", "go to the kitchen")
+    histories.set_system_prompt(SYSTEM_PROMPT)
+    assert len(histories) == 1
+    histories.set_system_prompt("You are a Behavior Tree fixer.")
+    assert histories.messages("Anna") == [{"role": "system", "content": "You are a Behavior Tree fixer."}]
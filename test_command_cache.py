@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+@author: smerino
+"""
+
+import pytest
+from Command_Cache import CommandCache, normalize_command, prompt_vocabulary, fingerprint
+from Prompt_Registry import BT_GENERATION_PROMPT
+
+with open(BT_GENERATION_PROMPT, "r", encoding="utf-8") as file:
+    VOCABULARY = prompt_vocabulary(file.read())
+
+
+def test_vocabulary_comes_from_the_prompt():
+    assert VOCABULARY == ["mesasergio", "ubisalon", "ubi1", "ubi2", "sergio", "david", "anna",
+                          "mybrother", "emergency"]
+
+
+@pytest.mark.parametrize("text", [
+    "Temi, go to mesa Sergio and say hello!",
+    "go to mesa sergi and say hello",
+    "Please go to mesasergio, and say: hello",
+])
+def test_command_variants_are_normalized(text):
+    assert normalize_command(text, VOCABULARY) == "go to mesasergio and say hello"
+
+
+def test_names_split_by_transcription_are_joined():
+    assert normalize_command("Go to ubi 1", VOCABULARY) == "go to ubi1"
+    assert normalize_command("Call my brother", VOCABULARY) == "call mybrother"
+    assert normalize_command("Call Sergi", VOCABULARY) == "call sergio"
+
+
+def test_different_commands_are_kept_apart():
+    assert normalize_command("go to ubi1", VOCABULARY) != normalize_command("go to ubi2", VOCABULARY)
+    assert normalize_command("go to mesa sergio", VOCABULARY) != normalize_command("call sergio", VOCABULARY)
+    assert normalize_command("don't go to ubi1", VOCABULARY) != normalize_command("go to ubi1", VOCABULARY)
+
+
+def test_cache_hit_and_expiry(tmp_path):
+    cache = CommandCache(str(tmp_path / "cache.json"), fingerprint("prompt"), ttl=60)
+    cache.put("go to the kitchen", "def create_behavior_tree(mqtt): ...")
+    assert cache.get("go to the kitchen") == "def create_behavior_tree(mqtt): ..."
+    cache.entries.put(cache.key("go to the kitchen"), {"code": "old", "time": 0})
+    assert cache.get("go to the kitchen") is None
+    assert len(cache) == 0
+
+
+def test_cache_survives_restarts_with_the_same_prompt(tmp_path):
+    path = str(tmp_path / "cache.json")
+    CommandCache(path, fingerprint("prompt")).put("go to the kitchen", "code")
+    assert CommandCache(path, fingerprint("prompt")).get("go to the kitchen") == "code"
+
+
+def test_cache_is_invalidated_when_the_prompt_changes(tmp_path):
+    path = str(tmp_path / "cache.json")
+    CommandCache(path, fingerprint("prompt")).put("go to the kitchen", "code")
+    cache = CommandCache(path, fingerprint("new prompt"))
+    assert cache.get("go to the kitchen") is None
+    assert len(cache) == 0
+
+
+def test_cache_is_cleared_when_the_prompt_is_reloaded(tmp_path):
+    cache = CommandCache(str(tmp_path / "cache.json"), fingerprint("prompt"))
+    cache.put("go to the kitchen", "code")
+    cache.set_fingerprint(fingerprint("new prompt"))
+    assert cache.get("go to the kitchen") is None
+    assert len(cache) == 0
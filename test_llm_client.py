@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+@author: smerino
+"""
+
+import json
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from LLM_Client import LLMClient, LLMError, CodeFenceParser
+
+
+# Local stand-in of the chat completions API. Each request takes the next
+# answer of the list: an HTTP status, or a reply text; "sleep" delays it.
+# Streamed replies are sent as server-sent events of 3 characters
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server.requests.append(body)
+        answer = server.answers.pop(0) if len(server.answers) > 1 else server.answers[0]
+        if answer == "sleep":
+            time.sleep(0.5)
+            answer = "late"
+        if isinstance(answer, int):
+            self.send_response(answer)
+            self.end_headers()
+            return
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for i in range(0, len(answer), 3):
+                event = {"choices": [{"delta": {"content": answer[i:i + 3]}}]}
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+        payload = json.dumps({"choices": [{"message": {"content": answer}}]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.requests = []
+    server.answers = ["Hello"]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def client_for(server, **kwargs):
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    return LLMClient(url=url, backoff=0.01, **kwargs)
+
+
+def test_complete_returns_reply(server):
+    llm = client_for(server)
+    messages = [{"role": "user", "content": "Go to the kitchen"}]
+    assert llm.complete(messages, max_tokens=10) == "Hello"
+    assert server.requests[0]["messages"] == messages
+    assert server.requests[0]["max_tokens"] == 10
+
+
+def test_prompt_fingerprint_is_sent_as_cache_key(server):
+    llm = client_for(server)
+    llm.complete([{"role": "user", "content": "Go to the kitchen"}], cache_key="0123abcd")
+    llm.complete([])
+    assert server.requests[0]["prompt_cache_key"] == "0123abcd"
+    assert "prompt_cache_key" not in server.requests[1]
+
+
+def test_server_errors_are_retried(server):
+    server.answers = [503, 429, "Hello"]
+    llm = client_for(server, retries=3)
+    assert llm.complete([]) == "Hello"
+    assert len(server.requests) == 3
+
+
+def test_error_after_retries(server):
+    server.answers = [500]
+    llm = client_for(server, retries=2)
+    with pytest.raises(LLMError):
+        llm.complete([])
+    assert len(server.requests) == 3
+
+
+def test_client_errors_are_not_retried(server):
+    server.answers = [400]
+    llm = client_for(server, retries=2)
+    with pytest.raises(LLMError):
+        llm.complete([])
+    assert len(server.requests) == 1
+
+
+def test_timeout(server):
+    server.answers = ["sleep"]
+    llm = client_for(server, timeout=0.1, retries=0)
+    with pytest.raises(LLMError):
+        llm.complete([])
+
+
+def test_requests_in_flight_at_once(server):
+    server.answers = ["sleep"]
+    llm = client_for(server, timeout=5, workers=4)
+    start = time.time()
+    futures = [llm.complete_async([]) for _ in range(4)]
+    assert [future.result() for future in futures] == ["late"] * 4
+    assert time.time() - start < 1.5
+
+
+REPLY = "Here is the tree:\n```python\ndef create_behavior_tree(mqtt):\n    return root\n```\nIt moves the robot."
+
+
+def test_stream_yields_reply(server):
+    server.answers = [REPLY]
+    llm = client_for(server)
+    chunks = list(llm.stream([]))
+    assert len(chunks) > 1
+    assert "".join(chunks) == REPLY
+    assert server.requests[0]["stream"] is True
+
+
+def test_parser_finds_code_when_fence_closes():
+    parser = CodeFenceParser()
+    results = [parser.feed(REPLY[i:i + 2]) for i in range(0, len(REPLY), 2)]
+    codes = [code for code in results if code is not None]
+    assert codes == ["def create_behavior_tree(mqtt):\n    return root\n"]
+    closed = results.index(codes[0])
+    assert parser.text.startswith(REPLY[:closed * 2])
+    assert len(REPLY) - (closed + 1) * 2 > 10
+
+
+def test_parser_without_code():
+    parser = CodeFenceParser()
+    for chunk in ["Sorry, I can", "not cook. Can I help ", "with anything else?"]:
+        assert parser.feed(chunk) is None
+    assert parser.code is None
+
+
+# The LLM modules read config.txt without importing the BT nodes, whose import
+# configures the log file
+def test_llm_modules_do_not_import_the_bt_nodes():
+    code = ("import sys, logging, LLM_Client, Chat_History, Command_Cache\n"
+            "print('BT_classes' in sys.modules, bool(logging.getLogger().handlers), bool(LLM_Client.config))")
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert output.split() == ["False", "False", "True"]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+@author: smerino
+"""
+
+import os
+import pytest
+from Prompt_Registry import PromptRegistry, prompt_fingerprint, BT_GENERATION_PROMPT, FAILURE_INTERPRETER_PROMPT
+
+
+def write_prompt(path, text, mtime):
+    path.write_text(text, encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def prompt_file(tmp_path):
+    path = tmp_path / "prompt.txt"
+    write_prompt(path, "You are a BT generator.\nInput:\n", 1000)
+    return path
+
+
+def test_prompt_is_loaded_once(prompt_file, monkeypatch):
+    prompts = PromptRegistry()
+    first = prompts.get(str(prompt_file))
+    assert first.text == "You are a BT generator.\nInput:\n"
+    assert first.fingerprint == prompt_fingerprint(first.text)
+    monkeypatch.setattr("builtins.open", None)
+    assert prompts.get(str(prompt_file)) is first
+
+
+def test_changed_prompt_is_reloaded(prompt_file):
+    prompts = PromptRegistry()
+    reloaded = []
+    prompts.subscribe(str(prompt_file), reloaded.append)
+    first = prompts.get(str(prompt_file))
+    write_prompt(prompt_file, "You are a BT fixer.\nInput:\n", 2000)
+    second = prompts.get(str(prompt_file))
+    assert second.text == "You are a BT fixer.\nInput:\n"
+    assert second.fingerprint != first.fingerprint
+    assert reloaded == [second]
+
+
+def test_touched_prompt_keeps_its_version(prompt_file):
+    prompts = PromptRegistry()
+    reloaded = []
+    prompts.subscribe(str(prompt_file), reloaded.append)
+    first = prompts.get(str(prompt_file))
+    os.utime(prompt_file, (3000, 3000))
+    assert prompts.get(str(prompt_file)).fingerprint == first.fingerprint
+    assert reloaded == []
+
+
+def test_last_version_is_kept_if_the_file_is_missing(prompt_file):
+    prompts = PromptRegistry()
+    first = prompts.get(str(prompt_file))
+    os.remove(prompt_file)
+    assert prompts.get(str(prompt_file)) is first
+    with pytest.raises(OSError):
+        prompts.get(str(prompt_file) + ".missing")
+
+
+def test_repository_prompts_load():
+    prompts = PromptRegistry()
+    for path in (BT_GENERATION_PROMPT, FAILURE_INTERPRETER_PROMPT):
+        assert prompts.get(path).text.rstrip().endswith("Input:")